@@ -1,5 +1,7 @@
+import asyncio
 import os
-from sqlalchemy import create_engine
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from sqlalchemy import create_engine, event
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
@@ -21,4 +23,127 @@ if url.startswith("postgresql://") and "+psycopg" not in url and "+psycopg2" not
     except Exception:
         url = url.replace("postgresql://", "postgresql+psycopg2://", 1)
 
-engine = create_engine(url, pool_pre_ping=True)
+SEARCH_PATH = "air_quality_demo_data, public"
+
+# Explicit pool sizing keeps request paths on warm connections instead of opening a new
+# TCP+TLS session whenever the default 5+10 is exhausted; recycle before idle timeouts bite.
+# LIFO checkout keeps reusing the most recently returned (hot) connections so the rest can
+# idle out, and TCP keepalives stop idle pooled connections from being silently dropped.
+engine = create_engine(
+    url,
+    pool_pre_ping=True,
+    pool_size=int(os.getenv("DB_POOL_SIZE", "8")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "8")),
+    pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    pool_use_lifo=True,
+    connect_args={
+        "connect_timeout": 10,
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 5,
+    },
+)
+
+@event.listens_for(engine, "connect")
+def _set_search_path(dbapi_conn, connection_record):
+    # Once per physical connection (not per checkout), so requests never pay for a SET.
+    # A session-level SET rather than a startup "options" param, which poolers may reject.
+    autocommit = dbapi_conn.autocommit
+    dbapi_conn.autocommit = True
+    cur = dbapi_conn.cursor()
+    cur.execute(f"SET search_path TO {SEARCH_PATH}")
+    cur.close()
+    dbapi_conn.autocommit = autocommit
+
+# Same pool, autocommit: single-statement reads run without BEGIN/COMMIT round trips.
+read_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+
+# ---------- Shared asyncpg pool for the async routes ----------
+# Created once on app startup (see backend.main) and stored on app.state.pool.
+ASYNC_POOL_MIN = int(os.getenv("ASYNC_POOL_MIN_SIZE", "2"))
+ASYNC_POOL_MAX = int(os.getenv("ASYNC_POOL_MAX_SIZE", "20"))
+
+def _asyncpg_dsn(u: str) -> str:
+    # asyncpg wants a plain postgresql:// URL and rejects libpq-only params like channel_binding.
+    u = u.replace("postgresql+psycopg2://", "postgresql://", 1).replace("postgresql+psycopg://", "postgresql://", 1)
+    parts = urlsplit(u)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "channel_binding"]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+async def _init_async_conn(conn):
+    # Once per physical connection, as for the SQLAlchemy engine above: a session-level SET
+    # rather than a search_path startup parameter, which poolers (PgBouncer) reject.
+    await conn.execute(f"SET search_path TO {SEARCH_PATH}")
+
+async def create_async_pool():
+    import asyncpg
+    return await asyncpg.create_pool(
+        _asyncpg_dsn(url),
+        min_size=ASYNC_POOL_MIN,
+        max_size=ASYNC_POOL_MAX,
+        command_timeout=60,
+        init=_init_async_conn,
+    )
+
+# ---------- COPY ... TO STDOUT streaming for CSV downloads ----------
+COPY_STREAM_CHUNK = 16 * 1024
+
+async def _stop(task: asyncio.Task):
+    # Make sure the COPY is no longer using the connection before it goes back to the pool.
+    if not task.done():
+        task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+
+async def stream_copy(pool, query: str, *args, header: bytes = b""):
+    """
+    Run COPY (query) TO STDOUT as CSV on a pooled asyncpg connection and relay its output.
+    Returns (first_chunk, body): first_chunk is None when the query returned no rows (the
+    connection is already released); otherwise body is an async iterator of header + CSV in
+    pieces of at least COPY_STREAM_CHUNK bytes that keeps the connection checked out until it
+    is exhausted or closed.
+    """
+    conn = await pool.acquire()
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=16)
+
+    async def copy_out():
+        try:
+            await conn.copy_from_query(query, *args, output=chunks.put, format="csv")
+        finally:
+            await chunks.put(None)
+
+    task = asyncio.create_task(copy_out())
+    try:
+        first = await chunks.get()
+        if first is None:
+            await task
+    except BaseException:
+        await _stop(task)
+        await pool.release(conn)
+        raise
+    if first is None:
+        await pool.release(conn)
+        return None, None
+
+    async def body(chunk):
+        # COPY hands over small pieces; coalesce them so each body chunk (and gzip flush) is
+        # at least COPY_STREAM_CHUNK bytes.
+        out = bytearray(header)
+        try:
+            while chunk is not None:
+                out += chunk
+                if len(out) >= COPY_STREAM_CHUNK:
+                    yield bytes(out)
+                    out.clear()
+                chunk = await chunks.get()
+            await task
+            if out:
+                yield bytes(out)
+        finally:
+            await _stop(task)
+            await pool.release(conn)
+
+    return first, body(first)
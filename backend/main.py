@@ -5,6 +5,7 @@
 #        Safe: a failing module won't crash startup; errors are logged.
 
 import os
+import asyncio
 import logging
 import importlib
 import pkgutil
@@ -12,17 +13,25 @@ from typing import Iterable, Any
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy import text
 
 # Your project database engine
 try:
-    from backend.database import engine  # expects ENGINE_DATABASE_URL to be configured
+    from backend.database import engine, create_async_pool  # expects ENGINE_DATABASE_URL to be configured
 except Exception:  # keep startup resilient even if DB import has issues
     engine = None
+    create_async_pool = None
 
 log = logging.getLogger("uvicorn.error")
 
-app = FastAPI(title="TSF Backend", version=os.getenv("APP_VERSION") or "dev")
+# orjson encodes the JSON endpoints (rows, filters, job ids) several times faster than stdlib json
+app = FastAPI(
+    title="TSF Backend",
+    version=os.getenv("APP_VERSION") or "dev",
+    default_response_class=ORJSONResponse,
+)
 
 # ---------- CORS ----------
 env_origins = os.getenv("ALLOWED_ORIGINS", "").strip()
@@ -35,14 +44,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ---------- Compression ----------
+# CSV exports compress very well; level 4 keeps CPU cost low on streamed responses.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=4)
+
 # ---------- Router auto-loader ----------
+def include_router_once(target: FastAPI, router: Any) -> bool:
+    # Entry shims (sitecustomize, main_debug_inject, ...) also include routers that the
+    # auto-loader already mounted; including one twice duplicates every route in the table.
+    seen = getattr(target.state, "included_routers", None)
+    if seen is None:
+        seen = target.state.included_routers = set()
+    if id(router) in seen:
+        return False
+    target.include_router(router)
+    seen.add(id(router))
+    return True
+
 def include_router_obj(obj: Any) -> bool:
     try:
         # APIRouter duck-typing: must have .routes attribute
         if obj is None:
             return False
         if hasattr(obj, "routes"):
-            app.include_router(obj)
+            include_router_once(app, obj)
             return True
         return False
     except Exception as e:
@@ -99,6 +124,33 @@ def mount_all_route_modules() -> None:
 
 mount_all_route_modules()
 
+# ---------- Shared async DB pool ----------
+# The /forms routes only run on this pool, so a database that is configured but unreachable
+# fails startup (after a few tries, e.g. for a waking serverless instance) rather than leaving
+# a worker up that answers 503 on every form.
+POOL_CONNECT_ATTEMPTS = 3
+
+@app.on_event("startup")
+async def open_pool():
+    app.state.pool = None
+    if create_async_pool is None:
+        return
+    for attempt in range(1, POOL_CONNECT_ATTEMPTS + 1):
+        try:
+            app.state.pool = await create_async_pool()
+            return
+        except Exception as e:
+            log.error(f"Failed to create async DB pool (attempt {attempt}/{POOL_CONNECT_ATTEMPTS}): {e}")
+            if attempt == POOL_CONNECT_ATTEMPTS:
+                raise
+            await asyncio.sleep(2 * attempt)
+
+@app.on_event("shutdown")
+async def close_pool():
+    pool = getattr(app.state, "pool", None)
+    if pool is not None:
+        await pool.close()
+
 # ---------- Meta endpoints ----------
 @app.api_route("/", methods=["GET","HEAD"], tags=["meta"])
 def root():
@@ -2,7 +2,7 @@
 # Version: v2.0 (2025-09-23)
 # Purpose: Non-invasive shim that imports your existing FastAPI app and mounts the debug router without editing backend/main.py.
 # Usage:
-#   uvicorn backend.main_debug_inject:app --host 0.0.0.0 --port 8000
+#   uvicorn backend.main_debug_inject:app --host 0.0.0.0 --port 8000 --loop uvloop --http httptools
 # Assumes your canonical app is exposed as `app` in `backend.main`.
 
 from importlib import import_module
@@ -11,6 +11,6 @@ from importlib import import_module
 _main = import_module("backend.main")
 app = getattr(_main, "app")
 
-# Now include the debug router
+# Now include the debug router (no-op if the auto-loader already mounted it)
 from backend.routes.views_debug import router as views_debug_router
-app.include_router(views_debug_router)
+_main.include_router_once(app, views_debug_router)
@@ -5,11 +5,13 @@ from fastapi import FastAPI
 
 # Try to reuse the project's existing app
 app = None
+include_once = None
 for modname in ("backend.main", "main"):
     try:
         m = importlib.import_module(modname)
         if hasattr(m, "app") and isinstance(m.app, FastAPI):
             app = m.app
+            include_once = getattr(m, "include_router_once", None)
             break
     except Exception:
         pass
@@ -21,5 +23,9 @@ if app is None:
 # Include the routes
 from backend.routes import forms_upload_historical as _u
 from backend.routes import debug_engine_db as _d
-app.include_router(_u.router)
-app.include_router(_d.router)
+# The project app's auto-loader may already have mounted these; don't register them twice.
+for _r in (_u.router, _d.router):
+    if include_once is not None:
+        include_once(app, _r)
+    else:
+        app.include_router(_r)
@@ -1,27 +1,36 @@
 from fastapi import APIRouter, HTTPException, Query
-from sqlalchemy import text
-from backend.database import engine
-import pandas as pd
+from sqlalchemy import text, bindparam, String
+from backend.database import read_engine
 
 router = APIRouter(prefix="/aggregate", tags=["aggregate"])
 
 DB_SCHEMA = "air_quality_demo_data"
 TABLE = f"{DB_SCHEMA}.air_quality_raw"
 
-@router.get("/state_daily")
-def state_daily(state: str, parameter: str, agg: str = Query("mean", pattern="^(mean|sum)$")):
-    sql = f"""
-    SELECT "Date Local"::date AS date, "Arithmetic Mean" AS value
+# Aggregate per day in Postgres: only one row per date comes back, already ordered and typed.
+# SUM of an all-NULL day is 0 (as the old pandas groupby sum gave), AVG stays NULL.
+# One statement per aggregate, built once at import with typed bind params.
+AGG_EXPR = {
+    "mean": 'AVG("Arithmetic Mean")::float8',
+    "sum": 'COALESCE(SUM("Arithmetic Mean"), 0)::float8',
+}
+AGG_SQL = {
+    agg: text(f"""
+    SELECT "Date Local"::date AS date, {expr} AS value
     FROM {TABLE}
     WHERE "State Name" = :state AND "Parameter Name" = :parameter
-    ORDER BY "Date Local"
-    """
-    with engine.begin() as conn:
-        rows = conn.execute(text(sql), {"state": state, "parameter": parameter}).mappings().all()
+    GROUP BY 1
+    ORDER BY 1
+    """).bindparams(bindparam("state", type_=String), bindparam("parameter", type_=String))
+    for agg, expr in AGG_EXPR.items()
+}
+
+@router.get("/state_daily")
+def state_daily(state: str, parameter: str, agg: str = Query("mean", pattern="^(mean|sum)$")):
+    with read_engine.connect() as conn:
+        rows = conn.execute(AGG_SQL[agg], {"state": state, "parameter": parameter}).all()
     if not rows:
         raise HTTPException(status_code=404, detail="No data for given filters")
 
-    df = pd.DataFrame(rows)
-    out = df.groupby("date", as_index=False)["value"].mean() if agg == "mean" else df.groupby("date", as_index=False)["value"].sum()
-    out["value"] = out["value"].astype(float)
-    return {"state": state, "parameter": parameter, "agg": agg, "series": out.to_dict(orient="records")}
+    series = [{"date": d, "value": v} for d, v in rows]
+    return {"state": state, "parameter": parameter, "agg": agg, "series": series}
@@ -1,6 +1,7 @@
 
 import os, json
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from fastapi import APIRouter, HTTPException
 from fastapi.params import Body
@@ -19,6 +20,9 @@ JOBS_DIR.mkdir(parents=True, exist_ok=True)
 def _csv_file(job_id: str) -> Path:
     return JOBS_DIR / f"{job_id}.csv"
 
+# One client (and its connection pool) per process: /status is polled repeatedly per job, and
+# a fresh client per call meant a new TCP/TLS handshake to Redis on every poll.
+@lru_cache(maxsize=1)
 def _redis() -> Redis:
     url = os.getenv("REDIS_URL") or os.getenv("REDIS_TLS_URL")
     if not url:
@@ -82,6 +86,10 @@ def status(job_id: str):
 @router.get("/download")
 def download(job_id: str):
     f = _csv_file(job_id)
-    if not f.exists():
+    # One stat serves both the existence check and the response headers (FileResponse would
+    # otherwise stat the file again before sending it).
+    try:
+        st = os.stat(f)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="file not ready")
-    return FileResponse(f, media_type="text/csv", filename=f.name)
+    return FileResponse(f, media_type="text/csv", filename=f.name, stat_result=st)
@@ -1,17 +1,26 @@
 # backend/routes/debug_engine_db.py
 import os
+from functools import lru_cache
 from fastapi import APIRouter
 from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
 
 router = APIRouter()
 
+@lru_cache(maxsize=4)
+def _engine(url: str):
+    # One engine (and pool) per URL; a new engine per probe left an orphaned pool behind on
+    # every call and paid a fresh connect each time.
+    return create_engine(
+        url, pool_pre_ping=True, pool_size=1, max_overflow=0, future=True,
+        connect_args={"connect_timeout": 10, "keepalives": 1, "keepalives_idle": 30},
+    )
+
 def probe(url: str):
     if not url:
         return {"ok": False, "error": "URL not set"}
     try:
-        eng = create_engine(url, pool_pre_ping=True, future=True)
-        with eng.begin() as conn:
+        with _engine(url).begin() as conn:
             db = conn.exec_driver_sql("select current_database()").scalar()
             sp = conn.exec_driver_sql("show search_path").scalar()
             ver = conn.exec_driver_sql("show server_version").scalar()
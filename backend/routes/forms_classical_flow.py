@@ -1,90 +1,129 @@
 
 from fastapi import APIRouter, Request, Form, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import text
-from backend.database import engine as app_engine
-import pandas as pd
+from cachetools import TTLCache
+from asyncpg.exceptions import UndefinedTableError
 import os
-from datetime import datetime
+import threading
 from uuid import uuid4
 
+from backend.database import stream_copy
+
 router = APIRouter(prefix="/forms", tags=["forms"])
 templates = Jinja2Templates(directory="backend/templates")
+# Parsed and compiled once at import; each request only renders.
+_classical_tpl = templates.env.get_template("forms/classical.html")
 
-DB_TABLE = "air_quality_raw"  # relies on search_path
-
-def _set_search_path(conn):
-    conn.execute(text("SET search_path TO air_quality_demo_data, public"))
-
-def _list_params():
-    sql = f"""
-        SELECT DISTINCT "Parameter Name" AS param
-        FROM {DB_TABLE}
-        WHERE "Parameter Name" IS NOT NULL
-        ORDER BY "Parameter Name"
-    """
-    with app_engine.begin() as conn:
-        _set_search_path(conn)
-        rows = conn.execute(text(sql)).mappings().all()
-    return [r["param"] for r in rows]
-
-def _list_states():
-    sql = f"""
-        SELECT DISTINCT "State Name" AS state
-        FROM {DB_TABLE}
-        WHERE "State Name" IS NOT NULL
-        ORDER BY "State Name"
-    """
-    with app_engine.begin() as conn:
-        _set_search_path(conn)
-        rows = conn.execute(text(sql)).mappings().all()
-    return [r["state"] for r in rows]
-
-def _daily_mean_df(parameter: str, state: str) -> pd.DataFrame:
-    sql = f"""
-        SELECT DATE("Date Local") AS date, AVG("Arithmetic Mean") AS value
-        FROM {DB_TABLE}
-        WHERE "Parameter Name" = :parameter AND "State Name" = :state
-        GROUP BY DATE("Date Local")
-        ORDER BY DATE("Date Local")
-    """
-    with app_engine.begin() as conn:
-        _set_search_path(conn)
-        rows = conn.execute(text(sql), {"parameter": parameter, "state": state}).mappings().all()
-    if not rows:
-        raise HTTPException(status_code=404, detail="No rows found for that Parameter/State.")
-    df = pd.DataFrame(rows).rename(columns={"date":"date","value":"value"})
-    return df
+DB_TABLE = "air_quality_raw"  # relies on search_path (set on the pool's connections)
+# Materialized listbox sources (sql/listbox_views.sql), refreshed on ingest
+MV_PARAMETERS = "mv_parameters"
+MV_PARAM_STATES = "mv_param_states"
+
+# Listbox values only change when new data is ingested; keep them for a few minutes instead
+# of querying on every page load.
+LISTBOX_TTL = int(os.getenv("LISTBOX_CACHE_TTL", "300"))
+_listbox_cache = TTLCache(maxsize=8, ttl=LISTBOX_TTL)
+# TTLCache is not thread-safe: it is cleared from the threadpool (ingest, /_invalidate) while
+# the event loop reads it. Never held across an await.
+_listbox_lock = threading.Lock()
+
+def _pool(request: Request):
+    pool = getattr(request.app.state, "pool", None)
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Database pool unavailable.")
+    return pool
+
+# Both listboxes in one round trip, tagged by kind and already sorted within each kind
+LISTBOX_SQL = f"""
+    SELECT 'param' AS kind, "Parameter Name" AS v FROM {MV_PARAMETERS}
+    UNION ALL
+    SELECT DISTINCT 'state', "State Name" FROM {MV_PARAM_STATES}
+    ORDER BY 1, 2
+"""
+# Same result straight from the raw table, for databases where sql/listbox_views.sql has not
+# been applied yet (slow: DISTINCT scans every measurement)
+LISTBOX_RAW_SQL = f"""
+    SELECT DISTINCT 'param' AS kind, "Parameter Name" AS v FROM {DB_TABLE} WHERE "Parameter Name" IS NOT NULL
+    UNION ALL
+    SELECT DISTINCT 'state', "State Name" FROM {DB_TABLE} WHERE "State Name" IS NOT NULL
+    ORDER BY 1, 2
+"""
+
+async def listboxes(pool):
+    with _listbox_lock:
+        cached = _listbox_cache.get("listboxes")
+    if cached is not None:
+        return cached
+    async with pool.acquire() as conn:
+        try:
+            rows = await conn.fetch(LISTBOX_SQL)
+        except UndefinedTableError:
+            rows = await conn.fetch(LISTBOX_RAW_SQL)
+    params = [r["v"] for r in rows if r["kind"] == "param"]
+    states = [r["v"] for r in rows if r["kind"] == "state"]
+    with _listbox_lock:
+        _listbox_cache["listboxes"] = (params, states)
+    return params, states
+
+# The whole export row is produced by Postgres and written out by COPY as CSV, so Python only
+# relays bytes. $1/$2 are the forecast id/name, $3/$4 the selection.
+EXPORT_SQL = f"""
+    SELECT $1::text AS forecast_id, $2::text AS forecast_name,
+           DATE("Date Local") AS date, AVG("Arithmetic Mean") AS value
+    FROM {DB_TABLE}
+    WHERE "Parameter Name" = $3 AND "State Name" = $4
+    GROUP BY DATE("Date Local")
+    ORDER BY DATE("Date Local")
+"""
+EXPORT_HEADER = b"forecast_id,forecast_name,date,value\n"
 
 def _safe_name(x: str) -> str:
     return "".join(c for c in x if c.isalnum() or c in ("-","_"," ")).strip().replace(" ","_")
 
 @router.get("/classical", response_class=HTMLResponse)
-def classical_form(request: Request):
-    params = _list_params()
-    states = _list_states()
-    return templates.TemplateResponse("forms/classical.html", {"request": request, "params": params, "states": states})
+async def classical_form(request: Request):
+    # The page is a pure function of the listboxes, so the rendered HTML is cached alongside
+    # them and dropped by the same TTL / ingest invalidation.
+    with _listbox_lock:
+        html = _listbox_cache.get("page")
+    if html is None:
+        params, states = await listboxes(_pool(request))
+        html = _classical_tpl.render(params=params, states=states)
+        with _listbox_lock:
+            _listbox_cache["page"] = html
+    return HTMLResponse(html)
 
-@router.post("/classical/run")
-def classical_run(parameter: str = Form(...), state: str = Form(...)):
-    # 1) Build aggregated series
-    df = _daily_mean_df(parameter, state)[["date","value"]]
+def invalidate_listboxes():
+    with _listbox_lock:
+        _listbox_cache.clear()
+
+@router.post("/classical/_invalidate")
+def classical_invalidate():
+    # Call after an ingest so the next page load re-reads the listboxes.
+    invalidate_listboxes()
+    return {"ok": True}
 
-    # 2) Identify
+@router.post("/classical/run")
+async def classical_run(request: Request, parameter: str = Form(...), state: str = Form(...)):
+    # 1) Identify
     forecast_id = str(uuid4())
     safe_param = _safe_name(parameter)
     safe_state = _safe_name(state)
     forecast_name = f"{safe_param}_{safe_state}"  # no date, no extension
 
-    # 3) Assemble final CSV: forecast_id, forecast_name, date, value
-    final_df = df.copy()
-    final_df.insert(0, "forecast_name", forecast_name)
-    final_df.insert(0, "forecast_id", forecast_id)
-
-    # 4) Save and return
-    jobs_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "_jobs"))
-    os.makedirs(jobs_dir, exist_ok=True)
-    out_path = os.path.abspath(os.path.join(jobs_dir, f"{forecast_name}.csv"))
-    final_df.to_csv(out_path, index=False)
-    return FileResponse(out_path, media_type="text/csv", filename=os.path.basename(out_path))
+    # 2) Run COPY ... TO STDOUT (FORMAT csv) on a pooled connection and relay it to the
+    #    response; the first chunk is awaited up front so an empty selection is still a 404
+    #    rather than an empty download.
+    first, body = await stream_copy(
+        _pool(request), EXPORT_SQL, forecast_id, forecast_name, parameter, state, header=EXPORT_HEADER,
+    )
+    if first is None:
+        raise HTTPException(status_code=404, detail="No rows found for that Parameter/State.")
+
+    # 3) Stream the CSV: forecast_id, forecast_name, date, value
+    return StreamingResponse(
+        body,
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{forecast_name}.csv"'},
+    )
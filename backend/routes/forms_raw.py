@@ -1,94 +1,134 @@
 
 from fastapi import APIRouter, Request, Form, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import text
-from backend.database import engine
-import pandas as pd
+import asyncio
 import os
+import tempfile
+import httpx
 from datetime import datetime
 
+from backend.database import stream_copy
+from backend.routes.forms_classical_flow import listboxes
+
 router = APIRouter(prefix="/forms", tags=["forms"])
 templates = Jinja2Templates(directory="backend/templates")
 
 DB_TABLE = "air_quality_demo_data.air_quality_raw"
+# Only the CLASSICAL_START_URL hook writes here (it is handed the file path); resolved once
+JOBS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "_jobs"))
 
-def _list_params():
-    sql = f"""
-        SELECT DISTINCT "Parameter Name" AS param
-        FROM {table}
-        WHERE "Parameter Name" IS NOT NULL
-        ORDER BY "Parameter Name"
-    """
-    with engine.begin() as conn:
-        return [r["param"] for r in conn.execute(text(sql.format(table=DB_TABLE))).mappings().all()]
-
-def _list_states():
-    sql = f"""
-        SELECT DISTINCT "State Name" AS state
-        FROM {table}
-        WHERE "State Name" IS NOT NULL
-        ORDER BY "State Name"
-    """
-    with engine.begin() as conn:
-        return [r["state"] for r in conn.execute(text(sql.format(table=DB_TABLE))).mappings().all()]
-
-def _daily_mean(parameter: str, state: str) -> pd.DataFrame:
-    sql = f"""
-        SELECT DATE("Date Local") AS date, AVG("Arithmetic Mean") AS value
-        FROM {table}
-        WHERE "Parameter Name" = :parameter AND "State Name" = :state
-        GROUP BY DATE("Date Local")
-        ORDER BY DATE("Date Local")
-    """
-    with engine.begin() as conn:
-        rows = conn.execute(text(sql.format(table=DB_TABLE)), {"parameter": parameter, "state": state}).mappings().all()
-    if not rows:
-        raise HTTPException(status_code=404, detail="No rows for that Parameter/State.")
-    df = pd.DataFrame(rows)
-    df.rename(columns={"date":"DATE","value":"VALUE"}, inplace=True)
-    return df
+# Queries go straight to the shared asyncpg pool (app.state.pool) rather than
+# through SQLAlchemy's text() compilation and Row/mapping wrappers.
+def _pool(request: Request):
+    pool = getattr(request.app.state, "pool", None)
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Database pool unavailable.")
+    return pool
+
+DAILY_MEAN_SQL = f"""
+    SELECT DATE("Date Local") AS date, AVG("Arithmetic Mean") AS value
+    FROM {DB_TABLE}
+    WHERE "Parameter Name" = $1 AND "State Name" = $2
+    GROUP BY DATE("Date Local")
+    ORDER BY DATE("Date Local")
+"""
+EXPORT_HEADER = b"DATE,VALUE\n"
 
 @router.get("/raw", response_class=HTMLResponse)
-def raw_form(request: Request):
-    params = _list_params()
-    states = _list_states()
+async def raw_form(request: Request):
+    # Same listboxes as /forms/classical: one query against the materialized views, shared
+    # TTL cache (dropped on ingest), so a page load normally costs no DB round trip.
+    params, states = await listboxes(_pool(request))
     return templates.TemplateResponse("forms/raw.html", {"request": request, "params": params, "states": states})
 
 @router.post("/raw/export")
-def raw_export(parameter: str = Form(...), state: str = Form(...)):
-    # Build aggregated series
-    df = _daily_mean(parameter, state)
-
+async def raw_export(request: Request, parameter: str = Form(...), state: str = Form(...)):
     # Filename: {Parameter}_{State}_{yyyymmdd}_raw.csv
     today = datetime.utcnow().strftime("%Y%m%d")
     safe_param = "".join(c for c in parameter if c.isalnum() or c in ("-","_")).strip().replace(" ", "_")
     safe_state = "".join(c for c in state if c.isalnum() or c in ("-","_")).strip().replace(" ", "_")
     fname = f"{safe_param}_{safe_state}_{today}_raw.csv"
 
-    # Save under backend/_jobs (ensure dir)
-    out_dir = os.path.join(os.path.dirname(__file__), "..", "_jobs")
-    os.makedirs(out_dir, exist_ok=True)
-    fpath = os.path.abspath(os.path.join(out_dir, fname))
-    df.to_csv(fpath, index=False)
+    # Aggregated series (date, value) formatted as CSV by Postgres (COPY ... TO STDOUT), so
+    # Python only relays bytes; an empty selection is still a 404 rather than an empty download.
+    first, body = await stream_copy(_pool(request), DAILY_MEAN_SQL, parameter, state, header=EXPORT_HEADER)
+    if first is None:
+        raise HTTPException(status_code=404, detail="No rows for that Parameter/State.")
+
+    # Optionally trigger classical via HTTP. Only that hook needs the CSV on disk (it is sent
+    # the path), so the download is teed into a temp file next to it as it streams; the file
+    # only becomes fpath, and the hook is only called, once the whole export has been sent. A
+    # download cut short leaves neither a truncated file nor a call.
+    start_url = os.getenv("CLASSICAL_START_URL")  # e.g., http://localhost:8000/classical/start
+    if not start_url:
+        return StreamingResponse(
+            body,
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{fname}"'},
+        )
+
+    fpath = os.path.join(JOBS_DIR, fname)
+    payload = {
+        "parameter": parameter,
+        "state": state,
+        "raw_csv": fpath
+    }
+    completed = False
+
+    async def tee(body):
+        nonlocal completed
+        part = await asyncio.to_thread(_open_part)
+        try:
+            async for piece in body:
+                await asyncio.to_thread(part.write, piece)
+                yield piece
+            await asyncio.to_thread(_commit_part, part, fpath)
+            completed = True
+        finally:
+            # Closing body explicitly returns the connection right away on a disconnect
+            await body.aclose()
+            if not completed:
+                _discard_part(part)
 
-    # Optionally trigger classical via HTTP (best-effort, non-blocking)
+    async def start_if_completed():
+        # Starlette runs the background task even when the client went away mid-stream
+        if completed:
+            await _start_classical(start_url, payload)
+
+    return StreamingResponse(
+        tee(body),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{fname}"'},
+        background=BackgroundTask(start_if_completed),
+    )
+
+# One keep-alive async client per process for the classical hook: the call is made on the event
+# loop (no thread per export) and reuses its connection (and TLS session) across exports.
+_classical_client = httpx.AsyncClient(timeout=3)
+
+async def _start_classical(start_url: str, payload: dict):
+    # Best-effort classical kickoff; never affects the response.
     try:
-        import threading, requests
-        start_url = os.getenv("CLASSICAL_START_URL")  # e.g., http://localhost:8000/classical/start
-        if start_url:
-            payload = {
-                "parameter": parameter,
-                "state": state,
-                "raw_csv": fpath
-            }
-            def _fire():
-                try:
-                    requests.post(start_url, json=payload, timeout=3)
-                except Exception:
-                    pass
-            threading.Thread(target=_fire, daemon=True).start()
+        await _classical_client.post(start_url, json=payload)
     except Exception:
         pass
 
-    return FileResponse(fpath, media_type="text/csv", filename=os.path.basename(fpath))
+def _open_part():
+    # Written under a temp name and renamed, so the hook never sees a partially written file;
+    # the directory is created on first use only.
+    if not os.path.isdir(JOBS_DIR):
+        os.makedirs(JOBS_DIR, exist_ok=True)
+    return tempfile.NamedTemporaryFile("wb", dir=JOBS_DIR, suffix=".part", delete=False)
+
+def _commit_part(part, fpath: str):
+    part.close()
+    os.replace(part.name, fpath)
+
+def _discard_part(part):
+    part.close()
+    try:
+        os.remove(part.name)
+    except OSError:
+        pass
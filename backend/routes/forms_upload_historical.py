@@ -1,19 +1,29 @@
 
 # forms_upload_historical.py
 # FastAPI router providing an HTML form and uploader that inserts CSV rows
-# directly into engine.staging_historical with strict column matching.
+# directly into engine.staging_historical (COPY FROM STDIN) with strict column matching.
+# The load runs as a background job; progress is streamed to the page over SSE.
 
-import os
 import io
+import os
+import re
 import csv
-from typing import List, Optional
+import codecs
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List
+from uuid import uuid4
 
-from fastapi import APIRouter, UploadFile, Form
-from fastapi.responses import HTMLResponse, PlainTextResponse
+from fastapi import APIRouter, Query, UploadFile
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from cachetools import TTLCache
 
+import pandas as pd
 import psycopg2
-from psycopg2 import sql
-from psycopg2.extras import execute_values
+from psycopg2 import errors, sql
 
 router = APIRouter()
 
@@ -33,12 +43,30 @@ EXPECTED_COLUMNS: List[str] = [
 TABLE_SCHEMA = "engine"
 TABLE_NAME = "staging_historical"
 
+# COPY with fully qualified, quoted identifiers to support hyphens; composed once at import
+COPY_STMT = sql.SQL("COPY {schema}.{table} ({cols}) FROM STDIN WITH (FORMAT csv)").format(
+    schema=sql.Identifier(TABLE_SCHEMA),
+    table=sql.Identifier(TABLE_NAME),
+    cols=sql.SQL(", ").join(sql.Identifier(c) for c in EXPECTED_COLUMNS),
+)
+# Same target, reading the upload bytes as-is (its header line is skipped by COPY)
+COPY_RAW_STMT = sql.SQL("COPY {schema}.{table} ({cols}) FROM STDIN WITH (FORMAT csv, HEADER)").format(
+    schema=sql.Identifier(TABLE_SCHEMA),
+    table=sql.Identifier(TABLE_NAME),
+    cols=sql.SQL(", ").join(sql.Identifier(c) for c in EXPECTED_COLUMNS),
+)
+
+# Prefer direct engine DB URL; resolved once at import
+DB_URL = os.getenv("ENGINE_DATABASE_URL_DIRECT") or os.getenv("ENGINE_DATABASE_URL") or os.getenv("DATABASE_URL") or ""
+
+# Fail fast on an unreachable host, and have the kernel probe the socket (no Python thread)
+# so a long load is not cut off silently by an idle-connection timeout on the way.
+CONNECT_ARGS = {"connect_timeout": 10, "keepalives": 1, "keepalives_idle": 30, "keepalives_interval": 10, "keepalives_count": 5}
+
 def _db_url() -> str:
-    # Prefer direct engine DB URL
-    url = os.getenv("ENGINE_DATABASE_URL_DIRECT") or os.getenv("ENGINE_DATABASE_URL") or os.getenv("DATABASE_URL")
-    if not url:
+    if not DB_URL:
         raise RuntimeError("ENGINE_DATABASE_URL_DIRECT is not set")
-    return url
+    return DB_URL
 
 @router.get("/forms/upload-historical", response_class=HTMLResponse)
 def upload_form() -> str:
@@ -53,21 +81,218 @@ def upload_form() -> str:
 <h3>Upload to <code>{TABLE_SCHEMA}.{TABLE_NAME}</code></h3>
 <p>The CSV must contain this header exactly, in this order:</p>
 <pre>{",".join(EXPECTED_COLUMNS)}</pre>
-<form action="/forms/upload-historical" method="post" enctype="multipart/form-data">
+<form id="f" action="/forms/upload-historical?async=1" method="post" enctype="multipart/form-data">
   <input name="file" type="file" accept=".csv" required />
   <input type="submit" value="Upload" />
 </form>
+<pre id="out"></pre>
+<script>
+  const out=document.getElementById('out');
+  document.getElementById('f').addEventListener('submit',async(e)=>{{
+    e.preventDefault();
+    out.textContent='Uploading...';
+    const r=await fetch(e.target.action,{{method:'POST',body:new FormData(e.target)}});
+    if(!r.ok){{ out.textContent=await r.text(); return; }}
+    const {{job_id}}=await r.json();
+    const es=new EventSource('/forms/upload-historical/stream/'+job_id);
+    es.onmessage=(ev)=>{{ out.textContent=ev.data; if(ev.data.includes('state=done')||ev.data.includes('state=error')) es.close(); }};
+    es.onerror=()=>{{ es.close(); }};
+  }});
+</script>
 </body></html>"""
 
-@router.post("/forms/upload-historical", response_class=PlainTextResponse)
-async def upload_csv(file: UploadFile):
-    # Read file
-    raw = await file.read()
-    buf = io.StringIO(raw.decode("utf-8-sig"))  # handle BOM if present
-    reader = csv.DictReader(buf)
+COPY_CHUNK = 64 * 1024  # characters handed to COPY per read() of the upload copy
+NORMALIZE_BLOCK = 8 * 1024 * 1024  # bytes of whole records parsed and normalized per pandas call
+
+# job_id -> {"job_id", "state", "inserted", "bytes", "total_bytes", "error", "waiters",
+# "mirrored"}; written by _ingest, read by the SSE stream. Progress is by bytes consumed from the
+# spooled file, so no pre-count pass. "waiters" holds (loop, asyncio.Event) for each open stream,
+# woken on every update. With REDIS_URL set, updates are also mirrored to Redis (a hash for the
+# state plus a stream to block on; throttled, see _notify), so a stream opened on another
+# worker, or after a restart, still works.
+# Entries expire like their Redis copy and the count is capped, so finished jobs do not pile up
+# for the life of the process; _ingest holds its own reference, so eviction never affects a load.
+PROGRESS_TTL = 86400  # seconds a job's progress is kept (here and in Redis)
+PROGRESS = TTLCache(maxsize=1024, ttl=PROGRESS_TTL)
+_progress_lock = threading.Lock()  # TTLCache is not thread-safe; uploads register from the threadpool
+# Loads run on their own small pool rather than as BackgroundTasks, so a burst of large
+# uploads queues here instead of holding the request threadpool (and its DB) for minutes.
+INGEST_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("INGEST_WORKERS", "2")), thread_name_prefix="ingest")
+SSE_HEARTBEAT = 15  # seconds between keepalive comments while nothing changes
+PROGRESS_FIELDS = ("state", "inserted", "bytes", "total_bytes", "error")
+REDIS_URL = os.getenv("REDIS_URL") or os.getenv("REDIS_TLS_URL") or ""
+
+@lru_cache(maxsize=1)
+def _redis():
+    from redis import Redis
+    return Redis.from_url(REDIS_URL, decode_responses=True)
+
+@lru_cache(maxsize=1)
+def _aredis():
+    from redis.asyncio import Redis
+    return Redis.from_url(REDIS_URL, decode_responses=True)
+
+def _rkeys(job_id: str):
+    return f"tsf:upload:{job_id}", f"tsf:upload:{job_id}:events"
+
+def _notify(prog: dict):
+    # _ingest runs in the threadpool; wake each stream on its own event loop.
+    for loop, event in list(prog["waiters"]):
+        loop.call_soon_threadsafe(event.set)
+    if REDIS_URL:
+        # The mirror is a blocking round trip on the load's thread, so it is only written when
+        # the state or the whole-percent progress changes (~100 writes per load, like the
+        # classical worker's progress), not on every chunk.
+        pct = 100 * prog["bytes"] // prog["total_bytes"] if prog["total_bytes"] else 0
+        if prog["mirrored"] == (prog["state"], pct):
+            return
+        prog["mirrored"] = (prog["state"], pct)
+        # Best effort: a Redis hiccup must not fail the load itself.
+        key, events = _rkeys(prog["job_id"])
+        try:
+            pipe = _redis().pipeline(transaction=False)
+            pipe.hset(key, mapping={f: "" if prog[f] is None else prog[f] for f in PROGRESS_FIELDS})
+            pipe.expire(key, PROGRESS_TTL)
+            pipe.xadd(events, {"state": prog["state"]}, maxlen=16, approximate=True)
+            pipe.expire(events, PROGRESS_TTL)
+            pipe.execute()
+        except Exception:
+            pass
+
+# Anything the normalizing path would change: whitespace at a cell edge (it strips cells with
+# str.strip(), so every character that removes counts, NBSP, \x1c-\x1f etc. included; line breaks
+# are left to the CSV parsers) and quoted empty cells (it turns them into NULL, raw COPY would
+# keep ""). Deliberately coarse; a false positive only means the file takes the normalizing
+# path. Patterns span at most four bytes, so scanning each chunk with the previous chunk's last
+# three bytes prepended catches them all.
+_WS = b"(?:" + b"|".join(
+    re.escape(c.encode()) for c in map(chr, range(0x3001)) if c.isspace() and c not in "\r\n"
+) + b")"
+_NEEDS_NORMALIZING = re.compile(
+    _WS + rb'+(?:[,"\r\n]|$)|(?:^|[,"\n])' + _WS + rb'|(?:^|[,\n])""(?:[,\r\n]|$)'
+)
+
+class _CopySource:
+    """
+    Read-only file-like object for cursor.copy_expert over an iterator of CSV text chunks, so
+    the upload is never held in memory as a whole.
+    """
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def read(self, size=-1):
+        # "" means end of data to COPY, so never hand over an empty chunk mid-stream
+        for piece in self._chunks:
+            if piece:
+                return piece
+        return ""
 
-    # Validate header strictly
-    header = reader.fieldnames or []
+def _record_blocks(fh, size: int):
+    # Blocks of whole CSV records: each ends at a line break outside quotes, i.e. one with an
+    # even number of quote characters before it ("" escapes keep the parity), so every block
+    # parses on its own.
+    rest = b""
+    while data := fh.read(size):
+        buf = rest + data
+        end = buf.rfind(b"\n")
+        odd = buf.count(b'"', 0, end) % 2 if end != -1 else 0
+        while odd and end != -1:
+            prev = buf.rfind(b"\n", 0, end)
+            odd ^= buf.count(b'"', max(prev, 0), end) % 2
+            end = prev
+        if end == -1:
+            rest = buf  # one record longer than the block so far
+            continue
+        yield buf[:end + 1]
+        rest = buf[end + 1:]
+    if rest:
+        yield rest
+
+def _normalized_chunks(fh, prog: dict):
+    # The header matches EXPECTED_COLUMNS exactly, so columns are taken by position. Each block
+    # goes through pandas' C reader with fixed names/usecols: short rows come back padded with
+    # empty cells and extra cells are dropped (DictReader's restval/restkey), empty lines are
+    # skipped; cells are then stripped column-wise. Re-encoded as CSV, blank and padded cells
+    # are unquoted empty fields, which COPY reads as NULL. The reader sizes its columns from the
+    # widest row it sees, so a full-width empty row is put in front of each block (and dropped)
+    # for blocks whose rows are all short.
+    ncols = len(EXPECTED_COLUMNS)
+    full_width = b"," * (ncols - 1) + b"\n"
+    fh.readline()  # header, validated on upload
+    for block in _record_blocks(fh, NORMALIZE_BLOCK):
+        df = pd.read_csv(
+            io.BytesIO(full_width + block), header=None, names=range(ncols), usecols=range(ncols),
+            dtype=str, keep_default_na=False, encoding="utf-8", low_memory=False,
+        ).iloc[1:]
+        prog["bytes"] = fh.tell()
+        if df.empty:
+            continue
+        df = df.apply(lambda col: col.str.strip())
+        prog["inserted"] += len(df)
+        _notify(prog)
+        yield df.to_csv(index=False, header=False, lineterminator="\n")
+
+def _raw_chunks(fh, prog: dict):
+    while chunk := fh.read(COPY_CHUNK):
+        prog["bytes"] = fh.tell()
+        _notify(prog)
+        yield chunk
+
+def _ingest(prog: dict, path: str, clean: bool):
+    prog["state"] = "running"
+    _notify(prog)
+    try:
+        with open(path, "rb") as fh:
+            # One COPY for the whole file, fed straight from disk: no per-row statement binding
+            with psycopg2.connect(_db_url(), **CONNECT_ARGS) as conn:
+                conn.set_client_encoding("UTF8")  # the raw path sends the upload's UTF-8 bytes
+                with conn.cursor() as cur:
+                    # Staging only: on a crash the file is simply loaded again, so the commit
+                    # need not wait for the WAL flush. LOCAL scopes it to this transaction.
+                    cur.execute("SET LOCAL synchronous_commit = off")
+                    if clean:
+                        # Nothing to normalize: hand the bytes to COPY unparsed. Ragged or blank
+                        # lines still need the normalizing path; COPY rejects those, so roll
+                        # back and load the file again that way.
+                        try:
+                            cur.copy_expert(COPY_RAW_STMT.as_string(conn), _CopySource(_raw_chunks(fh, prog)), size=COPY_CHUNK)
+                            prog["inserted"] = cur.rowcount
+                        except errors.BadCopyFileFormat:
+                            conn.rollback()
+                            cur.execute("SET LOCAL synchronous_commit = off")
+                            fh.seek(0)
+                            prog.update(inserted=0, bytes=0)
+                            clean = False
+                    if not clean:
+                        cur.copy_expert(COPY_STMT.as_string(conn), _CopySource(_normalized_chunks(fh, prog)), size=COPY_CHUNK)
+        prog.update(state="done", bytes=prog["total_bytes"])
+    except Exception as e:
+        prog.update(state="error", inserted=0, error=f"{type(e)} {e}")
+    finally:
+        _notify(prog)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _status_line(prog: dict) -> str:
+    if prog["state"] == "error":
+        return f"state=error inserted=0 error={prog['error']}"
+    if prog["state"] == "done":
+        n = prog["inserted"]
+        note = " note=empty file" if n == 0 else ""
+        return f"state=done inserted={n} total={n}{note}"
+    pct = 100 * prog["bytes"] // prog["total_bytes"] if prog["total_bytes"] else 0
+    return f"state={prog['state']} inserted={prog['inserted']} progress={pct}%"
+
+@router.post("/forms/upload-historical")
+def upload_csv(file: UploadFile, run_async: bool = Query(False, alias="async")):
+    # Validate header strictly (first line only), then spool the upload to a job file
+    try:
+        first = file.file.readline().decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        return PlainTextResponse(f"state=error inserted=0 total=0 error={e}", status_code=400)
+    header = next(csv.reader([first]), [])
     if header != EXPECTED_COLUMNS:
         return PlainTextResponse(
             f"state=error inserted=0 total=0 error=Header mismatch\n"
@@ -76,35 +301,124 @@ async def upload_csv(file: UploadFile):
             status_code=400,
         )
 
-    rows = list(reader)
-    total = len(rows)
-
-    if total == 0:
-        return PlainTextResponse("state=ok inserted=0 total=0 note=empty file")
+    # The upload is closed once the response is sent, so the job reads its own copy. The bytes
+    # are checked as strict UTF-8 on the way (incremental C decoder, nothing kept), so a bad
+    # file is a 400 here rather than a failed job. The same pass decides whether the file can
+    # go to COPY as-is (see _NEEDS_NORMALIZING).
+    file.file.seek(0)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    clean = True
+    tail = b""
+    tmp = tempfile.NamedTemporaryFile("wb", suffix=".csv", delete=False)
+    try:
+        with tmp:
+            while chunk := file.file.read(COPY_CHUNK):
+                decoder.decode(chunk)
+                if clean and _NEEDS_NORMALIZING.search(tail + chunk):
+                    clean = False
+                tail = chunk[-3:]
+                tmp.write(chunk)
+            decoder.decode(b"", final=True)
+            total_bytes = tmp.tell()
+    except UnicodeDecodeError as e:
+        os.remove(tmp.name)
+        return PlainTextResponse(f"state=error inserted=0 total=0 error=Invalid UTF-8: {e}", status_code=400)
+    except BaseException:
+        # I/O error or client gone mid-upload: nothing will ever read the copy
+        os.remove(tmp.name)
+        raise
 
-    # Prepare rows in same order as EXPECTED_COLUMNS; blank -> None
-    def norm(v: Optional[str]):
-        if v is None: 
-            return None
-        v = v.strip()
-        return None if v == "" else v
+    job_id = uuid4().hex
+    prog = {
+        "job_id": job_id, "state": "queued", "inserted": 0, "bytes": 0,
+        "total_bytes": total_bytes, "error": None, "waiters": [], "mirrored": None,
+    }
+    with _progress_lock:
+        PROGRESS[job_id] = prog
+    _notify(prog)
+    job = INGEST_POOL.submit(_ingest, prog, tmp.name, clean)
+    if run_async:
+        # The page: answer at once, progress follows over /stream/{job_id}
+        return {"job_id": job_id}
+    # Scripted callers keep the original synchronous plain-text answer
+    job.result()
+    if prog["state"] == "error":
+        return PlainTextResponse(f"state=error inserted=0 total=0 error={prog['error']}")
+    n = prog["inserted"]
+    note = " note=empty file" if n == 0 else ""
+    return PlainTextResponse(f"state=ok inserted={n} total={n}{note}")
 
-    data = [tuple(norm(r[col]) for col in EXPECTED_COLUMNS) for r in rows]
+@router.get("/forms/upload-historical/stream/{job_id}")
+async def upload_stream(job_id: str):
+    with _progress_lock:
+        prog = PROGRESS.get(job_id)
+    if prog is not None:
+        gen = _local_events(prog)
+    elif REDIS_URL:
+        gen = _redis_events(job_id)
+    else:
+        gen = _unknown_job()
 
-    # Compose INSERT with fully qualified, quoted identifiers to support hyphens
-    cols_ident = [sql.Identifier(c) for c in EXPECTED_COLUMNS]
-    insert_stmt = sql.SQL("INSERT INTO {schema}.{table} ({cols}) VALUES %s").format(
-        schema=sql.Identifier(TABLE_SCHEMA),
-        table=sql.Identifier(TABLE_NAME),
-        cols=sql.SQL(", ").join(cols_ident),
+    # identity encoding keeps GZipMiddleware from buffering the events inside its compressor
+    return StreamingResponse(
+        gen,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Content-Encoding": "identity"},
     )
 
-    # Execute in one batch
+async def _unknown_job():
+    yield "data: state=error inserted=0 error=unknown job\n\n"
+
+async def _local_events(prog: dict):
+    # Job running in this process: sleep until _ingest reports progress (or the heartbeat is due)
+    event = asyncio.Event()
+    waiter = (asyncio.get_running_loop(), event)
+    prog["waiters"].append(waiter)
     try:
-        with psycopg2.connect(_db_url()) as conn:
-            with conn.cursor() as cur:
-                execute_values(cur, insert_stmt.as_string(conn), data, page_size=1000)
-        inserted = total
-        return PlainTextResponse(f"state=ok inserted={inserted} total={total}")
-    except Exception as e:
-        return PlainTextResponse(f"state=error inserted=0 total={total} error={type(e)} {e}")
+        last = None
+        while True:
+            line = _status_line(prog)
+            if line != last:
+                yield f"data: {line}\n\n"
+                last = line
+            if prog["state"] in ("done", "error"):
+                return
+            try:
+                await asyncio.wait_for(event.wait(), timeout=SSE_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+            event.clear()
+    finally:
+        prog["waiters"].remove(waiter)
+
+async def _redis_events(job_id: str):
+    # Job owned by another worker: block on its Redis event stream, re-reading the hash per event
+    r = _aredis()
+    key, events = _rkeys(job_id)
+    # Take the stream position before reading the state, so no update falls in between
+    latest = await r.xrevrange(events, count=1)
+    last_id = latest[0][0] if latest else "0-0"
+    last = None
+    while True:
+        h = await r.hgetall(key)
+        if not h:
+            yield "data: state=error inserted=0 error=unknown job\n\n"
+            return
+        prog = {
+            "state": h["state"],
+            "inserted": int(h["inserted"]),
+            "bytes": int(h["bytes"]),
+            "total_bytes": int(h["total_bytes"]),
+            "error": h["error"] or None,
+        }
+        line = _status_line(prog)
+        if line != last:
+            yield f"data: {line}\n\n"
+            last = line
+        if prog["state"] in ("done", "error"):
+            return
+        resp = await r.xread({events: last_id}, block=SSE_HEARTBEAT * 1000)
+        if resp:
+            last_id = resp[0][1][-1][0]
+        else:
+            yield ": keepalive\n\n"
@@ -1,9 +1,11 @@
 import os
-from typing import Dict, List
+import threading
+from typing import Dict, List, Optional
 
 from fastapi import APIRouter, HTTPException, Query
-import psycopg
 from psycopg.rows import tuple_row
+from psycopg_pool import ConnectionPool
+from cachetools import TTLCache
 
 router = APIRouter(prefix="/data", tags=["metadata"])
 
@@ -17,19 +19,56 @@ DB_SCHEMA_MAP: Dict[str, Dict[str, object]] = {
     },
 }
 
+# Resolved once at import, keeping the precedence used elsewhere in the codebase.
+DB_URL = (
+    os.getenv("ENGINE_DATABASE_URL_DIRECT")
+    or os.getenv("ENGINE_DATABASE_URL")
+    or os.getenv("DATABASE_URL")
+    or ""
+)
+
 def _db_url() -> str:
     """
-    Resolve the database URL from environment variables.
-    Keep the original precedence used elsewhere in the codebase.
+    Return the database URL resolved at import; fail the request if none was configured.
     """
-    url = (
-        os.getenv("ENGINE_DATABASE_URL_DIRECT")
-        or os.getenv("ENGINE_DATABASE_URL")
-        or os.getenv("DATABASE_URL")
-    )
-    if not url:
+    if not DB_URL:
         raise RuntimeError("ENGINE_DATABASE_URL_DIRECT is not set")
-    return url
+    return DB_URL
+
+# One small pool per process, opened on first use: requests borrow a warm connection instead
+# of paying a TCP/TLS handshake and backend start-up on every call.
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def _connect():
+    """
+    Borrow a pooled autocommit connection (context manager returning it on exit).
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    _db_url(),
+                    min_size=1,
+                    max_size=int(os.getenv("META_POOL_MAX_SIZE", "4")),
+                    kwargs={
+                        "autocommit": True, "row_factory": tuple_row,
+                        # TCP keepalives keep idle pooled connections from being dropped
+                        "keepalives": 1, "keepalives_idle": 30,
+                        "keepalives_interval": 10, "keepalives_count": 5,
+                    },
+                    # Validate on checkout (pre-ping); replaces a dead connection transparently
+                    check=ConnectionPool.check_connection,
+                    open=True,
+                )
+    return _pool.connection()
+
+# Filter values only change when new data is ingested; keep each (db, target) answer for a few
+# minutes. Handlers run in the threadpool, so access is locked.
+FILTERS_TTL = int(os.getenv("FILTERS_CACHE_TTL", "300"))
+_filters_cache = TTLCache(maxsize=256, ttl=FILTERS_TTL)
+_filters_lock = threading.Lock()
 
 @router.get("/filters")
 def get_filters(
@@ -42,22 +81,54 @@ def get_filters(
     if db not in DB_SCHEMA_MAP:
         raise HTTPException(status_code=400, detail=f"Unknown db '{db}'")
 
+    key = (db, target)
+    with _filters_lock:
+        cached = _filters_cache.get(key)
+    if cached is not None:
+        return cached
+
     meta = DB_SCHEMA_MAP[db]
     table = meta["table"]
     target_col = meta["target_col"]
-    filters: Dict[str, List[str]] = {}
+    fcols: List[str] = list(meta["filters"])
+    filters: Dict[str, List[str]] = {fcol: [] for fcol in fcols}
 
-    # Build and execute queries safely with parameters. Identifiers are whitelisted from the map.
-    sql_template = 'SELECT DISTINCT "{fcol}" AS val FROM {table} WHERE "{tcol}" = %(target)s ORDER BY "{fcol}"'
+    # All filter columns in one scan and one round trip: each grouping set yields the distinct
+    # values of one column (the others NULL), tagged by GROUPING() and sorted per set by the
+    # server. Identifiers are whitelisted from the map; the target is a bound parameter.
+    cols_q = ", ".join(f'"{c}"' for c in fcols)
+    sets_q = ", ".join(f'("{c}")' for c in fcols)
+    sql = (
+        f'SELECT GROUPING({cols_q}) AS g, {cols_q} FROM {table} '
+        f'WHERE "{target_col}" = %(target)s '
+        f'GROUP BY GROUPING SETS ({sets_q}) '
+        f'ORDER BY {", ".join(str(i) for i in range(1, len(fcols) + 2))}'
+    )
+    # GROUPING() has a 1-bit for every column not in the row's set, leftmost column highest
+    n = len(fcols)
+    set_of_mask = {((1 << n) - 1) ^ (1 << (n - 1 - i)): i for i in range(n)}
 
-    dsn = _db_url()
-    # autocommit=True to avoid transaction overhead for simple reads
-    with psycopg.connect(dsn, autocommit=True, row_factory=tuple_row) as conn:
+    # Pooled connections are autocommit, so simple reads carry no transaction overhead
+    with _connect() as conn:
         with conn.cursor() as cur:
-            for fcol in meta["filters"]:
-                sql = sql_template.format(fcol=fcol, table=table, tcol=target_col)
-                cur.execute(sql, {"target": target})
-                vals = [row[0] for row in cur.fetchall() if row and row[0] is not None]
-                filters[fcol] = vals
+            cur.execute(sql, {"target": target}, prepare=True)
+            for row in cur.fetchall():
+                i = set_of_mask[row[0]]
+                val = row[1 + i]
+                if val is not None:
+                    filters[fcols[i]].append(val)
+
+    result = {"target": target, "filters": filters}
+    with _filters_lock:
+        _filters_cache[key] = result
+    return result
+
+def invalidate_filters():
+    with _filters_lock:
+        _filters_cache.clear()
 
-    return {"target": target, "filters": filters}
+@router.post("/filters/_invalidate")
+def filters_invalidate():
+    # Call after an ingest so the next request re-reads the filter values.
+    invalidate_filters()
+    return {"ok": True}
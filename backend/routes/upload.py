@@ -1,14 +1,50 @@
 from fastapi import APIRouter, UploadFile, File, Query, HTTPException
-from sqlalchemy import text
+from sqlalchemy import text, table, column
 from sqlalchemy.exc import SQLAlchemyError
 from backend.database import engine
 import pandas as pd
 import io
 
+# pyarrow is optional: when installed, large uploads are parsed by its multi-threaded reader.
+try:
+    import pyarrow  # noqa: F401
+    CSV_ENGINE_LARGE = "pyarrow"
+except Exception:
+    CSV_ENGINE_LARGE = "c"
+LARGE_UPLOAD = 1 << 20  # below 1 MiB the C parser is just as fast
+
 router = APIRouter(prefix="/upload", tags=["upload"])
 
 DB_SCHEMA = "air_quality_demo_data"
 TABLE = f"{DB_SCHEMA}.air_quality_raw"
+LISTBOX_VIEWS = ("mv_parameters", "mv_param_states")
+REFRESH_SQL = [text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {DB_SCHEMA}.{mv}") for mv in LISTBOX_VIEWS]
+AQ_COLUMNS = ["Date Local","Parameter Name","Arithmetic Mean","Local Site Name","State Name","County Name","City Name","CBSA Name"]
+# Lightweight Core table so executemany goes through SQLAlchemy's batched multi-row VALUES
+AQ_TABLE = table("air_quality_raw", *[column(c) for c in AQ_COLUMNS], schema=DB_SCHEMA)
+FALLBACK_PAGE = 1000
+COPY_SQL = f"""
+    COPY {TABLE} ("Date Local","Parameter Name","Arithmetic Mean",
+        "Local Site Name","State Name","County Name","City Name","CBSA Name")
+    FROM STDIN WITH (FORMAT csv)
+"""
+
+COPY_CHUNK = 1 << 20
+
+def _copy_csv(conn, sql: str, src):
+    # COPY a binary file object through the DBAPI connection under the SQLAlchemy transaction
+    # (psycopg 3 or psycopg2).
+    raw = conn.connection.dbapi_connection
+    cur = raw.cursor()
+    try:
+        if hasattr(cur, "copy"):
+            with cur.copy(sql) as cp:
+                while chunk := src.read(COPY_CHUNK):
+                    cp.write(chunk)
+        else:
+            cur.copy_expert(sql, src, size=COPY_CHUNK)
+    finally:
+        cur.close()
 
 @router.post("/air_quality")
 def upload_air_quality_csv(
@@ -16,8 +52,9 @@ def upload_air_quality_csv(
     on_conflict: str = Query("ignore", pattern="^(ignore|fail)$")
 ):
     try:
-        raw = file.file.read()
-        df = pd.read_csv(io.BytesIO(raw))
+        # Parse straight from the spooled upload; no full in-memory copy of the body first.
+        csv_engine = CSV_ENGINE_LARGE if (file.size or 0) > LARGE_UPLOAD else "c"
+        df = pd.read_csv(file.file, engine=csv_engine)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Cannot read CSV: {e}")
 
@@ -26,35 +63,68 @@ def upload_air_quality_csv(
     if missing:
         raise HTTPException(status_code=400, detail=f"Missing required columns: {missing}")
 
-    df = df.copy()
+    # df is the frame read_csv just built, so it is normalized in place (no defensive copy).
     df["Date Local"] = pd.to_datetime(df["Date Local"]).dt.date
     df["Arithmetic Mean"] = pd.to_numeric(df["Arithmetic Mean"], errors="coerce")
     df = df.dropna(subset=["Date Local","Arithmetic Mean"])
 
-    cols = ["Date Local","Parameter Name","Arithmetic Mean","Local Site Name","State Name","County Name","City Name","CBSA Name"]
-    insert_sql = f"""
-        INSERT INTO {TABLE} ("Date Local","Parameter Name","Arithmetic Mean",
-            "Local Site Name","State Name","County Name","City Name","CBSA Name")
-        VALUES (:Date_Local,:Parameter_Name,:Arithmetic_Mean,:Local_Site_Name,
-                :State_Name,:County_Name,:City_Name,:CBSA_Name)
-    """
-
-    inserted = 0
-    with engine.begin() as conn:
-        for _, row in df.iterrows():
-            try:
-                conn.execute(text(insert_sql), {
-                    "Date_Local": row.get("Date Local"),
-                    "Parameter_Name": row.get("Parameter Name"),
-                    "Arithmetic_Mean": row.get("Arithmetic Mean"),
-                    "Local_Site_Name": row.get("Local Site Name"),
-                    "State_Name": row.get("State Name"),
-                    "County_Name": row.get("County Name"),
-                    "City_Name": row.get("City Name"),
-                    "CBSA_Name": row.get("CBSA Name"),
-                })
-                inserted += 1
-            except SQLAlchemyError:
-                pass
+    cols = AQ_COLUMNS
+    # Bulk path: one COPY FROM STDIN of the whole frame (missing optional columns -> NULL).
+    # Encoded by pandas straight into a byte buffer in 50k-row chunks (no full str + encode copy).
+    data = io.BytesIO()
+    df.reindex(columns=cols).to_csv(
+        data, index=False, header=False, lineterminator="\n", chunksize=50_000, encoding="utf-8"
+    )
+    data.seek(0)
+    try:
+        with engine.begin() as conn:
+            _copy_csv(conn, COPY_SQL, data)
+        inserted = len(df)
+    except Exception as e:
+        if on_conflict == "fail":
+            raise HTTPException(status_code=400, detail=f"Bulk insert failed: {e}")
+        inserted = None
+
+    # on_conflict=ignore: COPY is all-or-nothing, so fall back to multi-row INSERT pages, each
+    # in a savepoint; only a page that fails is retried row by row to skip the bad rows.
+    if inserted is None:
+        inserted = 0
+        frame = df.reindex(columns=cols).astype(object)
+        frame = frame.where(frame.notna(), None)
+        recs = [dict(zip(cols, r)) for r in frame.itertuples(index=False, name=None)]
+        with engine.begin() as conn:
+            for i in range(0, len(recs), FALLBACK_PAGE):
+                page = recs[i:i + FALLBACK_PAGE]
+                try:
+                    with conn.begin_nested():
+                        conn.execute(AQ_TABLE.insert(), page)
+                    inserted += len(page)
+                    continue
+                except SQLAlchemyError:
+                    pass
+                for r in page:
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(AQ_TABLE.insert(), r)
+                        inserted += 1
+                    except SQLAlchemyError:
+                        pass
+
+    if inserted:
+        _refresh_listboxes()
 
     return {"rows_inserted": inserted}
+
+def _refresh_listboxes():
+    # Keep the form listboxes (sql/listbox_views.sql) in step with the raw table.
+    # Best effort: the upload itself has already been committed.
+    try:
+        with engine.begin() as conn:
+            for stmt in REFRESH_SQL:
+                conn.execute(stmt)
+    except SQLAlchemyError:
+        return
+    from backend.routes.forms_classical_flow import invalidate_listboxes
+    from backend.routes.meta import invalidate_filters
+    invalidate_listboxes()
+    invalidate_filters()
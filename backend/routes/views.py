@@ -10,9 +10,9 @@
 from typing import Optional, Dict, List
 from fastapi import APIRouter, HTTPException, Query as FQuery
 from fastapi.responses import HTMLResponse, StreamingResponse
-import os, traceback, datetime as dt
-import psycopg
+import os, traceback, threading
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 
 router = APIRouter(prefix="/views", tags=["views"])
 
@@ -24,11 +24,34 @@ def _db_url() -> str:
         or ""
     )
 
+# Connections are pooled so that statements executed with prepare=True stay prepared
+# server-side across requests instead of being parsed and planned on every call.
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
 def _connect():
-    dsn = _db_url()
-    if not dsn:
-        raise RuntimeError("Database URL not configured")
-    return psycopg.connect(dsn, autocommit=True)
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                dsn = _db_url()
+                if not dsn:
+                    raise RuntimeError("Database URL not configured")
+                _pool = ConnectionPool(
+                    dsn,
+                    min_size=1,
+                    max_size=int(os.getenv("VIEWS_POOL_MAX_SIZE", "10")),
+                    kwargs={
+                        "autocommit": True,
+                        # TCP keepalives keep idle pooled connections from being dropped
+                        "keepalives": 1, "keepalives_idle": 30,
+                        "keepalives_interval": 10, "keepalives_count": 5,
+                    },
+                    # Validate on checkout (pre-ping); replaces a dead connection transparently
+                    check=ConnectionPool.check_connection,
+                    open=True,
+                )
+    return _pool.connection()
 
 def _discover_views(conn) -> List[Dict[str,str]]:
     sql = """
@@ -41,7 +64,7 @@ def _discover_views(conn) -> List[Dict[str,str]]:
                        'tsf_vw_daily_best_hwes_a0')
     """
     with conn.cursor(row_factory=dict_row) as cur:
-        cur.execute(sql)
+        cur.execute(sql, prepare=True)
         rows = cur.fetchall()
     return [dict(r) for r in rows]
 
@@ -131,6 +154,10 @@ def views_form():
 
       function setStatus(msg){ el('status').textContent = msg; }
 
+      // Single-pass HTML escape for values interpolated into innerHTML
+      const ESC = {'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'};
+      const esc = (v) => String(v ?? '').replace(/[&<>"']/g, (c) => ESC[c]);
+
       async function ids(scope, model, series){
         const q = new URLSearchParams({scope, model: model||'', series: series||''});
         const r = await fetch('/views/ids?' + q.toString());
@@ -144,7 +171,7 @@ def views_form():
       function renderRows(rows){
         const body = el('tbody');
         body.innerHTML = rows.map(r => {
-          return `<tr>${HEADERS.map(h => `<td>${(r[h] ?? '')}</td>`).join('')}</tr>`;
+          return `<tr>${HEADERS.map(h => `<td>${esc(r[h])}</td>`).join('')}</tr>`;
         }).join('');
       }
 
@@ -191,7 +218,7 @@ def views_form():
       async function bootstrap(){
         renderHead();
         const list = await ids(SCOPE(), '', '');
-        el('fid').innerHTML = `<option value="" selected disabled>Select forecast…</option>` + list.map(x => `<option value="${x.id}">${x.name}</option>`).join('');
+        el('fid').innerHTML = `<option value="" selected disabled>Select forecast…</option>` + list.map(x => `<option value="${esc(x.id)}">${esc(x.name)}</option>`).join('');
       }
 
       document.addEventListener('DOMContentLoaded', () => {
@@ -219,19 +246,25 @@ def meta_form():
     except Exception as e:
         return {"error": str(e), "trace": traceback.format_exc(), "ok": False, "step": "meta_form"}
 
+IDS_MAX = 1000  # a dropdown longer than this is unusable; ?all=1 lifts the cap
+
 @router.get("/ids")
-def ids(scope: str = FQuery(...), model: Optional[str] = None, series: Optional[str] = None, limit: int = 100):
+def ids(scope: str = FQuery(...), model: Optional[str] = None, series: Optional[str] = None,
+        limit: int = 100, all_: bool = FQuery(False, alias="all")):
+    # LIMIT NULL means no limit, so one prepared statement serves both cases. Rows come back as
+    # tuples and the option list is built with one comprehension (no per-row dicts).
+    cap = None if all_ else max(1, min(IDS_MAX, limit))
     try:
-        with _connect() as conn, conn.cursor(row_factory=dict_row) as cur:
+        with _connect() as conn, conn.cursor() as cur:
             cur.execute("""
-                SELECT fr.forecast_id AS id,
+                SELECT fr.forecast_id::text AS id,
                        COALESCE(fr.forecast_name, fr.forecast_id::text) AS name
                 FROM engine.forecast_registry fr
                 ORDER BY fr.forecast_id
                 LIMIT %s
-            """, (limit,))
+            """, (cap,), prepare=True)
             rows = cur.fetchall()
-        return [{"id": str(r["id"]), "name": r["name"]} for r in rows]
+        return [{"id": i, "name": n} for i, n in rows]
     except Exception as e:
         return {"error": str(e), "trace": traceback.format_exc(), "ok": False, "step": "ids"}
 
@@ -271,61 +304,70 @@ def run_query(body: ViewsQueryBody):
 
         cols = "date, value, model_name, fv_l, fv, fv_u, fv_mean_mape, fv_interval_odds, fv_interval_sig, fv_variance, fv_variance_mean, fv_mean_mape_c, low, high"
         where_clause = " AND ".join(conds)
-        sql = f"SELECT {cols} FROM {vname} v JOIN engine.forecast_registry fr ON fr.forecast_name = v.forecast_name WHERE {where_clause} ORDER BY date ASC LIMIT %s OFFSET %s"
+        # The page and the total come back in one round trip: COUNT(*) OVER () is evaluated
+        # before LIMIT/OFFSET, so every row carries the full match count.
+        sql = f"SELECT {cols}, COUNT(*) OVER () AS _total FROM {vname} v JOIN engine.forecast_registry fr ON fr.forecast_name = v.forecast_name WHERE {where_clause} ORDER BY date ASC LIMIT %s OFFSET %s"
         cnt = f"SELECT COUNT(*) AS n FROM {vname} v JOIN engine.forecast_registry fr ON fr.forecast_name = v.forecast_name WHERE {where_clause}"
 
         with conn.cursor(row_factory=dict_row) as cur:
-            cur.execute(cnt, params)
-            total = int(cur.fetchone()["n"])
-            cur.execute(sql, params + [limit, offset])
+            cur.execute(sql, params + [limit, offset], prepare=True)
             rows = cur.fetchall()
+            if rows:
+                total = int(rows[0]["_total"])
+                for r in rows:
+                    del r["_total"]
+            elif offset:
+                # Paged past the end: no row to read the total from, so count separately.
+                cur.execute(cnt, params, prepare=True)
+                total = int(cur.fetchone()["n"])
+            else:
+                total = 0
 
     return {"rows": rows, "total": total}
 
+EXPORT_CHUNK = 64 * 1024  # bytes per yielded body chunk
+
+def _copy_chunks(copy):
+    # Postgres formats the CSV; COPY blocks are small, so coalesce them into larger chunks.
+    out = bytearray()
+    for block in copy:
+        out += block
+        if len(out) >= EXPORT_CHUNK:
+            yield bytes(out)
+            out.clear()
+    if out:
+        yield bytes(out)
+
 @router.get("/export")
 def export_csv(scope: str, model: Optional[str] = None, series: Optional[str] = None,
                forecast_id: str = FQuery(...), date_from: Optional[str] = None, date_to: Optional[str] = None):
     # Stream full CSV (no pagination)
     with _connect() as conn:
         views = _discover_views(conn)
-        vname = _resolve_view(scope, model, series, views)
-
-        conds = ["fr.forecast_id = %s"]
-        params = [forecast_id]
-        if date_from:
-            conds.append("v.date >= %s")
-            params.append(date_from)
-        if date_to:
-            conds.append("v.date <= %s")
-            params.append(date_to)
-
-        cols = ["date","value","model_name","fv_l","fv","fv_u","fv_mean_mape","fv_interval_odds","fv_interval_sig","fv_variance","fv_variance_mean","fv_mean_mape_c","low","high"]
-        base = f"FROM {vname} v JOIN engine.forecast_registry fr ON fr.forecast_name = v.forecast_name WHERE " + " AND ".join(conds)
-        sql = f"SELECT {', '.join(cols)} " + base + " ORDER BY date ASC"
-
-        def row_iter():
-            yield (",".join(cols) + "\n").encode("utf-8")
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-                for rec in cur:
-                    # rec is a tuple in declared column order
-                    line = []
-                    for v in rec:
-                        if v is None:
-                            line.append("")
-                        elif isinstance(v, dt.date):
-                            line.append(v.isoformat())
-                        else:
-                            s = str(v)
-                            if any(ch in s for ch in [',','\n','"']):
-                                s = '"' + s.replace('"','""') + '"'
-                            line.append(s)
-                    yield (",".join(line) + "\n").encode("utf-8")
-
-        fname_bits = [scope or 'view']
-        if model: fname_bits.append(model)
-        if series: fname_bits.append(series.upper())
-        if forecast_id: fname_bits.append(str(forecast_id))
-        filename = "tsf_export_" + "_".join(fname_bits) + ".csv"
-        return StreamingResponse(row_iter(), media_type="text/csv",
-                                 headers={"Content-Disposition": f"attachment; filename={filename}"})
+    vname = _resolve_view(scope, model, series, views)
+
+    conds = ["fr.forecast_id = %s"]
+    params = [forecast_id]
+    if date_from:
+        conds.append("v.date >= %s")
+        params.append(date_from)
+    if date_to:
+        conds.append("v.date <= %s")
+        params.append(date_to)
+
+    cols = ["date","value","model_name","fv_l","fv","fv_u","fv_mean_mape","fv_interval_odds","fv_interval_sig","fv_variance","fv_variance_mean","fv_mean_mape_c","low","high"]
+    base = f"FROM {vname} v JOIN engine.forecast_registry fr ON fr.forecast_name = v.forecast_name WHERE " + " AND ".join(conds)
+    sql = f"COPY (SELECT {', '.join(cols)} " + base + " ORDER BY date ASC) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+    def row_iter():
+        # The pooled connection is held for as long as the response is streaming.
+        with _connect() as conn, conn.cursor() as cur, cur.copy(sql, params) as copy:
+            yield from _copy_chunks(copy)
+
+    fname_bits = [scope or 'view']
+    if model: fname_bits.append(model)
+    if series: fname_bits.append(series.upper())
+    if forecast_id: fname_bits.append(str(forecast_id))
+    filename = "tsf_export_" + "_".join(fname_bits) + ".csv"
+    return StreamingResponse(row_iter(), media_type="text/csv",
+                             headers={"Content-Disposition": f"attachment; filename={filename}"})
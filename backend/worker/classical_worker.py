@@ -1,13 +1,14 @@
 
-import os, json
+import os, io, json
 from typing import Optional
+from functools import lru_cache
 from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pandas as pd
 import numpy as np
 import psycopg2
-from psycopg2.extras import RealDictCursor
 
 from statsmodels.tsa.holtwinters import ExponentialSmoothing, Holt
 import pmdarima as pm  # auto.arima
@@ -23,8 +24,22 @@ for _k in ["DATABASE_URL", "NEON_DATABASE_URL", "PGCHANNELBINDING"]:
 os.environ["PGCHANNELBINDING"] = os.environ.get("PGCHANNELBINDING", "disable").strip()
 
 DEFAULT_TABLE = os.getenv("TSF_TABLE", "air_quality_raw")
+SEARCH_PATH_OPTIONS = "-c search_path=air_quality_demo_data,public"
+# SES/HOLT run a full (grid-searched) optimization every N folds; folds in between start the
+# optimizer from the previous fold's estimates. 1 (default) optimizes every fold from scratch.
+REFIT_EVERY = max(1, int(os.getenv("TSF_REFIT_EVERY", "1")))
+# Worker processes for the walk-forward tracks; 1 keeps everything in-process with per-fold progress.
+TRACK_WORKERS = max(1, int(os.getenv("TSF_TRACK_WORKERS", "1")))
+# Smoothing factor of the EWM level used when a model fails to fit
+FALLBACK_ALPHA = 0.3
 
-def _get_conn():
+# (model, monthly column, quarterly column); each model is one independent walk-forward track
+TRACKS = [("SES", "SES-M", "SES-Q"), ("HOLT", "HWES-M", "HWES-Q"), ("ARIMA", "ARIMA-M", "ARIMA-Q")]
+COLUMNS = [m for _, m, _ in TRACKS] + [q for _, _, q in TRACKS]
+
+@lru_cache(maxsize=1)
+def _dsn() -> str:
+    # Built once per worker process; env is fixed for the process lifetime.
     dsn = os.getenv("DATABASE_URL", "").strip()
     if not dsn:
         host = os.getenv("NEON_HOST", "").strip()
@@ -38,7 +53,16 @@ def _get_conn():
     if "sslmode=" not in dsn:
         sep = "&" if "?" in dsn else "?"
         dsn = f"{dsn}{sep}sslmode=require"
-    conn = psycopg2.connect(dsn, cursor_factory=RealDictCursor)
+    return dsn
+
+def _get_conn():
+    dsn = _dsn()
+    # Set search_path as a startup option so it needs no extra round-trip; poolers that reject
+    # startup options get the old SET after connecting.
+    try:
+        return psycopg2.connect(dsn, options=SEARCH_PATH_OPTIONS)
+    except psycopg2.OperationalError:
+        conn = psycopg2.connect(dsn)
     try:
         with conn.cursor() as cur:
             cur.execute("SET search_path TO air_quality_demo_data, public")
@@ -46,48 +70,79 @@ def _get_conn():
         pass
     return conn
 
-def _load_daily(parameter: str, state: Optional[str], county: Optional[str], city: Optional[str], cbsa: Optional[str]) -> pd.DataFrame:
+def _load_daily(parameter: str, state: Optional[str], county: Optional[str], city: Optional[str], cbsa: Optional[str], agg: str = "mean") -> pd.DataFrame:
     where = ['"Parameter Name" = %s']
     params = [parameter]
     if state:  where.append('"State Name" = %s');  params.append(state)
     if county: where.append('"County Name" = %s'); params.append(county)
     if city:   where.append('"City Name" = %s');   params.append(city)
     if cbsa:   where.append('"CBSA Name" = %s');   params.append(cbsa)
+    # Daily aggregation happens in SQL; the periods only need their start dates afterwards.
+    # NULL measurements are filtered so every output row is a fixed-width (date, float8) pair.
+    fn = "SUM" if agg == "sum" else "AVG"
+    where.append('"Arithmetic Mean" IS NOT NULL')
     q = f'''
-        SELECT DATE("Date Local") AS date, AVG("Arithmetic Mean") AS value
-        FROM {DEFAULT_TABLE}
-        WHERE {' AND '.join(where)}
-        GROUP BY DATE("Date Local")
-        ORDER BY DATE("Date Local")
+        COPY (
+            SELECT DATE("Date Local") AS date, {fn}("Arithmetic Mean")::float8 AS value
+            FROM {DEFAULT_TABLE}
+            WHERE {' AND '.join(where)}
+            GROUP BY DATE("Date Local")
+            ORDER BY DATE("Date Local")
+        ) TO STDOUT WITH (FORMAT binary)
     '''
+    # Binary COPY: no text formatting on the server and no number/date parsing here; the
+    # payload is decoded with one numpy view.
+    buf = io.BytesIO()
     with _get_conn() as conn, conn.cursor() as cur:
-        cur.execute(q, params)
-        rows = cur.fetchall()
-    if not rows:
+        cur.copy_expert(cur.mogrify(q, params).decode(), buf)
+    dates, values = _decode_date_float8(buf.getbuffer())
+    if len(dates) == 0:
         raise RuntimeError("No data for selection")
-    df = pd.DataFrame(rows).rename(columns={"date":"DATE","value":"VALUE"})
-    df["DATE"] = pd.to_datetime(df["DATE"])
+    df = pd.DataFrame({"DATE": dates, "VALUE": values})
     df = df.sort_values("DATE").reset_index(drop=True)
     return df
 
+_PG_EPOCH = np.datetime64("2000-01-01", "D")
+_PG_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+# One COPY BINARY tuple of (date, float8): field count, then length-prefixed values
+_DATE_FLOAT8_ROW = np.dtype([("n", ">i2"), ("l1", ">i4"), ("d", ">i4"), ("l2", ">i4"), ("v", ">f8")])
+
+def _decode_date_float8(payload) -> tuple:
+    data = memoryview(payload)
+    if bytes(data[:11]) != _PG_COPY_SIGNATURE:
+        raise RuntimeError("Unexpected COPY BINARY header")
+    start = 19 + int.from_bytes(data[15:19], "big")  # signature, flags, header extension
+    body = data[start:len(data) - 2]                  # trailing -1 field count
+    if len(body) % _DATE_FLOAT8_ROW.itemsize:
+        raise RuntimeError("Unexpected COPY BINARY row layout")
+    rows = np.frombuffer(body, dtype=_DATE_FLOAT8_ROW)
+    if not ((rows["n"] == 2).all() and (rows["l1"] == 4).all() and (rows["l2"] == 8).all()):
+        raise RuntimeError("Unexpected COPY BINARY row layout")
+    dates = (_PG_EPOCH + rows["d"].astype("timedelta64[D]")).astype("datetime64[ns]")
+    return dates, rows["v"].astype(np.float64)
+
 # ---- stability helpers ----
-def _ensure_positive(y: pd.Series) -> bool:
-    return (y > 0).all()
+def _ensure_positive(y: np.ndarray) -> bool:
+    return bool((y > 0).all())
 
-def _zscale(series: pd.Series):
+def _zscale(series: np.ndarray):
     m = float(series.mean())
     s = float(series.std(ddof=0))
     if not np.isfinite(s) or s == 0.0:
         s = 1.0
     return (series - m) / s, m, s
 
-def _inv_zscale(fc: pd.Series, m: float, s: float):
+def _inv_zscale(fc: np.ndarray, m: float, s: float):
     return fc * s + m
 
-def _detect_fast_seasonality(y: pd.Series) -> Optional[int]:
+def _autocorr(y: np.ndarray, lag: int) -> float:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return float(np.corrcoef(y[lag:], y[:-lag])[0, 1])
+
+def _detect_fast_seasonality(y: np.ndarray) -> Optional[int]:
     cands = [7, 30, 365]
     best_m, best_r = None, 0.0
-    y0 = y.dropna()
+    y0 = y[np.isfinite(y)]
     if len(y0) < 30:
         return None
     mu = y0.mean()
@@ -97,39 +152,72 @@ def _detect_fast_seasonality(y: pd.Series) -> Optional[int]:
     for m in cands:
         if len(yv) <= m + 2:
             continue
-        r = float(yv.autocorr(lag=m) or 0.0)
+        r = _autocorr(yv, m) or 0.0
         if abs(r) > abs(best_r) and abs(r) >= 0.2:
             best_r, best_m = r, m
     return best_m
 
-def _forecast_daily_path(y_train: pd.Series, horizon_dates: pd.DatetimeIndex, model: str) -> pd.Series:
-    steps = len(horizon_dates)
+# Estimated parameters in the order fit(start_params=...) takes them (non-seasonal models)
+_START_PARAM_NAMES = ("smoothing_level", "smoothing_trend", "smoothing_seasonal",
+                      "initial_level", "initial_trend", "damping_trend")
+
+def _start_params(fit) -> np.ndarray:
+    v = np.array([fit.params.get(k, np.nan) for k in _START_PARAM_NAMES], dtype=float)
+    return v[np.isfinite(v)]  # parameters the model doesn't have come back as NaN
+
+def _fit_warm(es_model, warm: Optional[dict], key: str, refit: bool):
+    # Warm start across walk-forward folds: between re-optimization points the optimizer is
+    # seeded with the previous fold's estimates (which skips the brute-force grid search) but
+    # still converges on this fold's data; refit folds, and anything the seed doesn't fit,
+    # optimize from scratch.
+    cached = warm.get(key) if warm is not None else None
+    fit = None
+    if cached is not None and not refit:
+        try:
+            fit = es_model.fit(optimized=True, start_params=cached)
+        except ValueError:
+            fit = None
+    if fit is None:
+        fit = es_model.fit(optimized=True)
+    if warm is not None:
+        warm[key] = _start_params(fit)
+    return fit
+
+def _fallback_level(yz: np.ndarray, m: float, s: float, level: Optional[float]) -> float:
+    # EWM is linear, so the z-scaled EWM is just the raw-scale running level rescaled.
+    if level is not None:
+        return (level - m) / s
+    return float(pd.Series(yz).ewm(alpha=FALLBACK_ALPHA, adjust=False).mean().iloc[-1])
+
+def _forecast_daily_path(y_train: np.ndarray, steps: int, model: str,
+                         warm: Optional[dict] = None, refit: bool = True,
+                         level: Optional[float] = None) -> np.ndarray:
+    # y_train is a plain float array (usually a view into the full series); no pandas objects
+    # are built per fold. `level` is the EWM of y_train (raw scale) if the caller tracks it.
     if steps <= 0:
-        return pd.Series(index=horizon_dates, dtype=float)
-    if y_train.nunique(dropna=True) <= 1:
-        const_val = float(y_train.dropna().iloc[-1])
-        return pd.Series([const_val]*steps, index=horizon_dates, dtype=float)
+        return np.empty(0)
+    if np.ptp(y_train) == 0:
+        return np.full(steps, float(y_train[-1]))
     yz, m, s = _zscale(y_train)
 
     if model == "SES":
         if _ensure_positive(y_train):
             try:
-                fit = ExponentialSmoothing(yz, trend='mul', seasonal=None, initialization_method="estimated", use_boxcox=True, remove_bias=True).fit(optimized=True)
+                fit = _fit_warm(ExponentialSmoothing(yz, trend='mul', seasonal=None, initialization_method="estimated", use_boxcox=True, remove_bias=True), warm, "SES:mul", refit)
                 fc = fit.forecast(steps)
             except Exception:
-                fit = ExponentialSmoothing(yz, trend='add', seasonal=None, initialization_method="estimated").fit(optimized=True)
+                fit = _fit_warm(ExponentialSmoothing(yz, trend='add', seasonal=None, initialization_method="estimated"), warm, "SES:add", refit)
                 fc = fit.forecast(steps)
         else:
-            fit = ExponentialSmoothing(yz, trend='add', seasonal=None, initialization_method="estimated").fit(optimized=True)
+            fit = _fit_warm(ExponentialSmoothing(yz, trend='add', seasonal=None, initialization_method="estimated"), warm, "SES:add", refit)
             fc = fit.forecast(steps)
 
     elif model == "HOLT":
         try:
-            fit = Holt(yz, exponential=False, damped_trend=True, initialization_method="estimated").fit(optimized=True)
+            fit = _fit_warm(Holt(yz, exponential=False, damped_trend=True, initialization_method="estimated"), warm, "HOLT", refit)
             fc = fit.forecast(steps)
         except Exception:
-            last = yz.ewm(alpha=0.3, adjust=False).mean().iloc[-1]
-            fc = pd.Series([last]*steps, index=horizon_dates, dtype=float)
+            fc = np.full(steps, _fallback_level(yz, m, s, level))
 
     elif model == "ARIMA":
         try:
@@ -142,80 +230,104 @@ def _forecast_daily_path(y_train: pd.Series, horizon_dates: pd.DatetimeIndex, mo
                 max_p=2, max_q=2, max_d=1, max_P=1, max_Q=1, max_D=1, max_order=5,
                 n_jobs=1,
             )
-            fc_vals = arma.predict(steps)
-            fc = pd.Series(fc_vals, index=horizon_dates, dtype=float)
+            fc = arma.predict(steps)
         except Exception:
-            last = yz.ewm(alpha=0.3, adjust=False).mean().iloc[-1]
-            fc = pd.Series([last]*steps, index=horizon_dates, dtype=float)
+            fc = np.full(steps, _fallback_level(yz, m, s, level))
     else:
         raise ValueError("Unknown model")
 
-    if not isinstance(fc, pd.Series):
-        fc = pd.Series(fc, index=horizon_dates, dtype=float)
-    else:
-        fc.index = horizon_dates
-
-    out = _inv_zscale(fc, m, s)
-    q1, q3 = float(y_train.quantile(0.25)), float(y_train.quantile(0.75))
+    out = _inv_zscale(np.asarray(fc, dtype=float), m, s)
+    q1, q3 = np.quantile(y_train, [0.25, 0.75])
     iqr = max(1e-9, q3 - q1)
     lo = q1 - 10.0 * iqr
     hi = q3 + 10.0 * iqr
-    return out.clip(lo, hi)
+    return np.clip(out, lo, hi)
+
+def _horizon_end(start: pd.Timestamp, period: str) -> pd.Timestamp:
+    if period == "monthly":
+        return start + pd.offsets.MonthEnd(0)
+    return start + pd.offsets.QuarterEnd(startingMonth=12)
+
+def _run_track(y: pd.Series, starts: dict, model: str, n_days: int, step=None) -> np.ndarray:
+    # One walk-forward track per model, filling its monthly and quarterly columns together.
+    # Every quarter start is also a month start with the same training prefix, so that fold is
+    # fitted once with the longer quarterly horizon and the monthly path is its leading slice.
+    # Tracks share nothing, so they can run in parallel.
+    # Returns an (n_days, 2) array aligned to the shared daily index starting at y.index[0].
+    out = np.full((n_days, 2), np.nan)
+    first_day = y.index[0]
+    yv = y.to_numpy(dtype=float)
+    q_index = {st: k for k, st in enumerate(starts["quarterly"]) if k > 0}
+    nq = len(starts["quarterly"]) - 1
+    warm = {}
+    # Running EWM of the history for the fallback path, advanced only over the new days each fold.
+    level, seen = yv[0], 1
+    months = starts["monthly"]
+    n = len(months) - 1
+    for i in range(1, len(months)):
+        start = months[i]
+        steps = (_horizon_end(start, "monthly") - start).days + 1
+        k = q_index.get(start)
+        steps_q = (_horizon_end(start, "quarterly") - start).days + 1 if k else 0
+        # y is daily and gap-free, so the training window is a positional prefix (a view).
+        pos = (start - first_day).days
+        if pos <= 0: continue
+        while seen < pos:
+            level = FALLBACK_ALPHA * yv[seen] + (1.0 - FALLBACK_ALPHA) * level
+            seen += 1
+        refit = (i - 1) % REFIT_EVERY == 0
+        path = _forecast_daily_path(yv[:pos], max(steps, steps_q), model, warm, refit, level)
+        out[pos:pos + steps, 0] = path[:steps]
+        if step is not None:
+            step("monthly", model, start, i, n)
+        if k:
+            out[pos:pos + steps_q, 1] = path
+            if step is not None:
+                step("quarterly", model, start, k, nq)
+    return out
 
 def _build_final(daily: pd.DataFrame, tick):
-    idx_daily = daily["DATE"]
     y = daily.set_index("DATE")["VALUE"].asfreq("D").interpolate(limit_direction="both")
-    m_starts = y.resample("MS").mean().index
-    q_starts = y.resample("QS").mean().index
-    total_steps = max(0, (len(m_starts)-1)*3) + max(0, (len(q_starts)-1)*3)
+    first, last = y.index[0], y.index[-1]
+    starts = {
+        "monthly": pd.date_range(first.to_period("M").start_time, last, freq="MS"),
+        "quarterly": pd.date_range(first.to_period("Q").start_time, last, freq="QS"),
+    }
+    # Shared daily index for every track, computed once: history plus the last forecast horizon.
+    ends = [_horizon_end(st[-1], period) for period, st in starts.items() if len(st) > 1]
+    all_days = pd.date_range(start=y.index[0], end=max([y.index[-1]] + ends), freq="D")
+    n_days = len(all_days)
+    total_steps = max(0, (len(starts["monthly"])-1)*3) + max(0, (len(starts["quarterly"])-1)*3)
     done = 0
-    def step(model_label, period_label):
+    # ~100 progress updates are plenty for the UI; each one is a Redis write, so skip the rest
+    # and only format the labels for folds that are actually reported.
+    every = max(1, total_steps // 100)
+    def step(period, model, start, i, n):
         nonlocal done
         done += 1
+        if done % every and done != total_steps:
+            return
         pct = 10 + int(80 * (done / max(1, total_steps)))
-        tick(model_label, pct, period_label)
-
-    # monthly
-    tick("monthly", 20, "initializing")
-    ses_m = pd.Series(index=pd.DatetimeIndex([]), dtype=float)
-    holt_m = pd.Series(index=pd.DatetimeIndex([]), dtype=float)
-    arima_m = pd.Series(index=pd.DatetimeIndex([]), dtype=float)
-    for i in range(1, len(m_starts)):
-        start = m_starts[i]
-        end = start + pd.offsets.MonthEnd(0)
-        horizon = pd.date_range(start=start, end=end, freq="D")
-        train_end = start - pd.Timedelta(days=1)
-        y_train = y.loc[:train_end].dropna()
-        if y_train.empty: continue
-        ses_m = pd.concat([ses_m, _forecast_daily_path(y_train, horizon, "SES")]);  step("monthly: SES", f"{start.date()} ({i}/{len(m_starts)-1})")
-        holt_m = pd.concat([holt_m, _forecast_daily_path(y_train, horizon, "HOLT")]); step("monthly: HOLT", f"{start.date()} ({i}/{len(m_starts)-1})")
-        arima_m = pd.concat([arima_m, _forecast_daily_path(y_train, horizon, "ARIMA")]); step("monthly: ARIMA", f"{start.date()} ({i}/{len(m_starts)-1})")
-    # quarterly
-    tick("quarterly", 60, "initializing")
-    ses_q = pd.Series(index=pd.DatetimeIndex([]), dtype=float)
-    holt_q = pd.Series(index=pd.DatetimeIndex([]), dtype=float)
-    arima_q = pd.Series(index=pd.DatetimeIndex([]), dtype=float)
-    for i in range(1, len(q_starts)):
-        start = q_starts[i]
-        end = start + pd.offsets.QuarterEnd(startingMonth=12)
-        horizon = pd.date_range(start=start, end=end, freq="D")
-        train_end = start - pd.Timedelta(days=1)
-        y_train = y.loc[:train_end].dropna()
-        if y_train.empty: continue
-        ses_q = pd.concat([ses_q, _forecast_daily_path(y_train, horizon, "SES")]);   step("quarterly: SES", f"{start.date()} ({i}/{len(q_starts)-1})")
-        holt_q = pd.concat([holt_q, _forecast_daily_path(y_train, horizon, "HOLT")]); step("quarterly: HOLT", f"{start.date()} ({i}/{len(q_starts)-1})")
-        arima_q = pd.concat([arima_q, _forecast_daily_path(y_train, horizon, "ARIMA")]); step("quarterly: ARIMA", f"{start.date()} ({i}/{len(q_starts)-1})")
-
-    last_day = pd.Timestamp(max([(s.index.max() if len(s.index) else idx_daily.max()) for s in [ses_m, holt_m, arima_m, ses_q, holt_q, arima_q]]))
-    all_days = pd.date_range(start=idx_daily.min(), end=last_day, freq="D")
-    out = pd.DataFrame(index=all_days)
-    out["VALUE"]   = y.reindex(all_days)
-    out["SES-M"]   = ses_m.reindex(all_days)
-    out["HWES-M"]  = holt_m.reindex(all_days)
-    out["ARIMA-M"] = arima_m.reindex(all_days)
-    out["SES-Q"]   = ses_q.reindex(all_days)
-    out["HWES-Q"]  = holt_q.reindex(all_days)
-    out["ARIMA-Q"] = arima_q.reindex(all_days)
+        tick(f"{period}: {model}", pct, f"{start.date()} ({i}/{n})")
+
+    out_matrix = np.empty((n_days, len(COLUMNS)), order="F")
+    if TRACK_WORKERS > 1:
+        # Fold-level progress can't cross process boundaries; report once per finished track.
+        workers = min(TRACK_WORKERS, len(TRACKS))
+        tick("tracks", 20, f"running {len(TRACKS)} tracks on {workers} workers")
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futs = {ex.submit(_run_track, y, starts, model, n_days): (cm, cq) for model, cm, cq in TRACKS}
+            for k, fut in enumerate(as_completed(futs), 1):
+                cm, cq = futs[fut]
+                out_matrix[:, [COLUMNS.index(cm), COLUMNS.index(cq)]] = fut.result()
+                tick(cm.split("-")[0], 10 + int(80 * k / len(futs)), f"track done ({k}/{len(futs)})")
+    else:
+        for model, cm, cq in TRACKS:
+            tick(model, 10 + int(80 * (done / max(1, total_steps))), "initializing")
+            out_matrix[:, [COLUMNS.index(cm), COLUMNS.index(cq)]] = _run_track(y, starts, model, n_days, step)
+
+    out = pd.DataFrame(out_matrix, index=all_days, columns=COLUMNS)
+    out.insert(0, "VALUE", y.reindex(all_days))
     out = out.reset_index().rename(columns={"index":"DATE"})
     return out
 
@@ -229,7 +341,7 @@ def run_job(job_id: str, target_value: str, state_name: Optional[str], county_na
 
     job.meta["progress"] = 5; job.meta["message"] = "queued"; job.save_meta()
 
-    df_daily = _load_daily(target_value, state_name, county_name, city_name, cbsa_name)
+    df_daily = _load_daily(target_value, state_name, county_name, city_name, cbsa_name, agg)
     job.meta["progress"] = 15; job.meta["message"] = "loading-data"; job.save_meta()
 
     final = _build_final(df_daily, tick)
@@ -237,7 +349,27 @@ def run_job(job_id: str, target_value: str, state_name: Optional[str], county_na
 
     out_dir = Path(jobs_dir); out_dir.mkdir(parents=True, exist_ok=True)
     out_path = out_dir / f"{job_id}.csv"
-    final.to_csv(out_path, index=False)
+    # Binary sink with a 1 MiB buffer: pandas encodes each chunk once and the OS sees large
+    # block writes rather than a text wrapper flushing every 8 KiB.
+    with open(out_path, "wb", buffering=1 << 20) as fh:
+        final.to_csv(fh, index=False, chunksize=50_000)
 
     job.meta["progress"] = 100; job.meta["message"] = "ready"; job.save_meta()
     return {"csv": str(out_path)}
+
+def _warmup():
+    # Run each model once on a tiny synthetic series so the first real job doesn't pay the
+    # statsmodels/pmdarima lazy-import and first-call setup cost on the user's critical path.
+    y = np.sin(np.arange(24) / 3.0) + 2.0
+    for model in ("SES", "HOLT", "ARIMA"):
+        _forecast_daily_path(y, 4, model)
+
+# Off by default: jobs are enqueued by dotted path, so a stock `rq worker` imports this module
+# inside each forked work horse and the warm-up would run on every job. Only enable it where
+# the module is imported once in the worker parent before forking (a custom entry point that
+# imports it before starting the Worker).
+if os.getenv("TSF_WARMUP", "0") == "1":
+    try:
+        _warmup()
+    except Exception:
+        pass
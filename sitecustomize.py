@@ -16,9 +16,10 @@ try:
     from backend.routes.views_meta_debug import router as views_meta_debug_router
     from backend.routes.views_debug import router as views_debug_router
 
-    # Mount meta debug FIRST to override any existing /views/meta
-    app.include_router(views_meta_debug_router)
-    app.include_router(views_debug_router)
+    # include_router_once skips routers the auto-loader in backend.main already mounted, so
+    # nothing here overrides an existing route; it only adds the ones still missing.
+    _main.include_router_once(app, views_meta_debug_router)
+    _main.include_router_once(app, views_debug_router)
 
     # Optional: print to stdout so logs confirm activation
     print("[sitecustomize] Debug routers mounted: /views/meta and /views/debug/*", file=sys.stderr)
@@ -0,0 +1,17 @@
+-- Indexes on the raw measurements table used by the forms, exports and worker
+-- CONCURRENTLY avoids locking out ingest; run outside a transaction block (e.g. plain psql).
+
+-- Daily-mean series: every export and worker load filters "Parameter Name" = ... AND
+-- "State Name" = ... and aggregates "Arithmetic Mean" per DATE("Date Local"). With the date and
+-- the value in the index, those become index-only scans of just the selected pair (check with
+-- EXPLAIN (ANALYZE, BUFFERS) after a VACUUM). The plain "Date Local" column is indexed rather
+-- than DATE("Date Local"): the expression is computed from the index tuple either way, and a
+-- column works whatever the column's type (a cast from text/timestamptz is not IMMUTABLE).
+-- The (Parameter Name, State Name) prefix also serves the listbox views' loose index scans
+-- (sql/listbox_views.sql).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS air_quality_raw_param_state_date_idx
+    ON air_quality_demo_data.air_quality_raw ("Parameter Name", "State Name", "Date Local")
+    INCLUDE ("Arithmetic Mean");
+
+-- Superseded by the index above (same leading columns)
+DROP INDEX CONCURRENTLY IF EXISTS air_quality_demo_data.air_quality_raw_param_state_idx;
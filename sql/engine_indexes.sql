@@ -0,0 +1,9 @@
+-- Indexes on the forecast engine tables read by /views
+-- CONCURRENTLY avoids locking out the engine's writers; run outside a transaction block.
+
+-- /views/ids lists the registry ORDER BY forecast_id LIMIT n, and /views/query + /views/export
+-- look a forecast up by id and join on its name. Carrying forecast_name in the index makes all
+-- of these index-only scans: the sort is read in index order and no heap fetch is needed for
+-- the name (the COALESCE(forecast_name, forecast_id::text) label is computed from the tuple).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS forecast_registry_id_name_idx
+    ON engine.forecast_registry (forecast_id) INCLUDE (forecast_name);
@@ -0,0 +1,49 @@
+-- Listbox sources for the forms (/forms/classical)
+-- DISTINCT over the raw table scans every measurement; these views hold only the distinct
+-- (parameter, state) pairs and are refreshed after each ingest (POST /upload/air_quality).
+-- They are filled with loose index scans (recursive CTEs that jump from one distinct value to
+-- the next through air_quality_raw_param_state_date_idx, see sql/air_quality_indexes.sql), so a
+-- refresh costs O(distinct values) index probes rather than a full scan.
+-- Re-running this file rebuilds both views.
+SET search_path TO air_quality_demo_data, public;
+
+BEGIN;
+
+DROP MATERIALIZED VIEW IF EXISTS mv_parameters;
+DROP MATERIALIZED VIEW IF EXISTS mv_param_states;
+
+CREATE MATERIALIZED VIEW mv_parameters AS
+    WITH RECURSIVE t(p) AS (
+        SELECT min("Parameter Name") FROM air_quality_raw
+        UNION ALL
+        SELECT (SELECT min("Parameter Name") FROM air_quality_raw WHERE "Parameter Name" > t.p)
+        FROM t
+        WHERE t.p IS NOT NULL
+    )
+    SELECT p AS "Parameter Name" FROM t WHERE p IS NOT NULL;
+
+CREATE MATERIALIZED VIEW mv_param_states AS
+    WITH RECURSIVE t(p, s) AS (
+        (SELECT "Parameter Name", "State Name"
+         FROM air_quality_raw
+         WHERE "Parameter Name" IS NOT NULL AND "State Name" IS NOT NULL
+         ORDER BY 1, 2
+         LIMIT 1)
+        UNION ALL
+        SELECT n.p, n.s
+        FROM t, LATERAL (
+            SELECT "Parameter Name" AS p, "State Name" AS s
+            FROM air_quality_raw
+            WHERE ("Parameter Name", "State Name") > (t.p, t.s)
+              AND "Parameter Name" IS NOT NULL AND "State Name" IS NOT NULL
+            ORDER BY 1, 2
+            LIMIT 1
+        ) n
+    )
+    SELECT p AS "Parameter Name", s AS "State Name" FROM t;
+
+-- Unique indexes are required for REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX ux_mv_parameters ON mv_parameters ("Parameter Name");
+CREATE UNIQUE INDEX ux_mv_param_states ON mv_param_states ("Parameter Name", "State Name");
+
+COMMIT;